@@ -1,19 +1,242 @@
 from __future__ import print_function
 
+import contextlib
+import hashlib
 import os
 import pathlib
 import sys
 import textwrap
-from collections import defaultdict
+import threading
 
 import tabulate
 
+# paths of the files written in each thread, see collect_outputs()
+_outputs = threading.local()
+
+
+@contextlib.contextmanager
+def collect_outputs():
+    """
+    Collect the paths of all tables written in this thread.
+    """
+    _outputs.paths = paths = []
+    try:
+        yield paths
+    finally:
+        del _outputs.paths
+
+
+def record_output(path):
+    paths = getattr(_outputs, "paths", None)
+    if paths is not None:
+        paths.append(path)
+
+
+def hash_file(path, chunk_size=1 << 16):
+    """
+    SHA-256 digest of a file, or None if it does not exist.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.digest()
+
+
+class ChangedFileWriter(object):
+    """
+    Text file writer that only replaces ``path`` if what was written
+    differs from what is already there, so that unchanged tables keep
+    their mtime and Sphinx does not rebuild the pages that include them.
+
+    Text is streamed to a temporary file next to ``path`` and hashed as
+    it is written. On closing, ``path`` is replaced atomically if the
+    contents changed; ``changed`` records whether it was.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.changed = False
+        self._tmp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        self._file = open(self._tmp, "wb")
+        self._hash = hashlib.sha256()
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        self._hash.update(data)
+        self._file.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        if exc_type is not None:
+            os.remove(self._tmp)
+            return
+        if hash_file(self.path) == self._hash.digest():
+            os.remove(self._tmp)
+        else:
+            os.replace(self._tmp, self.path)
+            self.changed = True
+
+
+def write_if_changed(path, contents):
+    """
+    Write ``contents`` to ``path`` only if they differ from what is
+    already there. Returns whether the file was written.
+    """
+    with ChangedFileWriter(path) as f:
+        f.write(contents)
+    return f.changed
+
+
+def _width_function():
+    # tabulate measures wide characters if wcwidth is installed
+    wcwidth = getattr(tabulate, "wcwidth", None)
+    if wcwidth is not None and getattr(tabulate, "WIDE_CHARS_MODE", False):
+        return wcwidth.wcswidth
+    return len
+
+
+def _is_text(value):
+    """
+    Whether tabulate would treat a value as text rather than a number
+    or bool. A column is text if any of its values is.
+    """
+    return tabulate._type(value) is str
+
+
+def write_rst_table(f, rows, headers=(), indent=""):
+    """
+    Write ``tabulate.tabulate(rows, headers, tablefmt="rst")``, indented
+    with ``indent``, to the file ``f`` one row at a time.
+
+    ``rows`` is read twice: once to work out the column widths, and once
+    to write the rows. Only text columns are handled; tabulate aligns
+    numbers by their decimal point and escapes an empty first column.
+    If the table has either, or multi-line or ANSI-coloured cells,
+    nothing is written and False is returned so that the caller can
+    fall back to tabulate.
+    """
+    width_fn = _width_function()
+    headers = [str(h) for h in headers]
+    n_columns = len(headers)
+    widths = [width_fn(h) + tabulate.MIN_PADDING for h in headers]
+    is_text = [False] * n_columns
+    n_rows = 0
+
+    # first pass: column widths and types
+    for row in rows:
+        n_rows += 1
+        if len(row) > n_columns:
+            if headers:
+                return False
+            widths.extend([0] * (len(row) - n_columns))
+            is_text.extend([False] * (len(row) - n_columns))
+            n_columns = len(row)
+        elif headers and len(row) < n_columns:
+            return False
+        for i, value in enumerate(row):
+            if isinstance(value, bytes):
+                return False
+            if value is None:
+                continue
+            cell = f"{value}"
+            if "\n" in cell or "\x1b" in cell:
+                return False
+            widths[i] = max(widths[i], width_fn(cell.strip()))
+            is_text[i] = is_text[i] or _is_text(value)
+        if not row or row[0] is None or not f"{row[0]}".strip():
+            return False
+
+    if not n_rows or not all(is_text):
+        return False
+    if any("\n" in h or "\x1b" in h for h in headers):
+        return False
+    if headers and not headers[0].strip():
+        return False
+
+    def write_row(cells):
+        padded = []
+        for cell, width in zip(cells, widths):
+            padded.append(cell + " " * (width - width_fn(cell)))
+        f.write(indent + "  ".join(padded).rstrip() + "\n")
+
+    # second pass: write rows
+    line = indent + "  ".join("=" * w for w in widths).rstrip()
+    f.write(line + "\n")
+    if headers:
+        write_row(headers)
+        f.write(line + "\n")
+    for row in rows:
+        cells = ["" if x is None else f"{x}".strip() for x in row]
+        cells.extend([""] * (n_columns - len(cells)))
+        write_row(cells)
+    f.write(line)
+    return True
+
+
+class Columns(dict):
+    """
+    Table columns by name. A column is computed over every row the
+    first time it is looked up.
+    """
+
+    def __init__(self, evaluate):
+        super(Columns, self).__init__()
+        self._evaluate = evaluate
+
+    def __missing__(self, name):
+        values = self[name] = self._evaluate(name)
+        return values
+
+
+def generated_by(obj):
+    """
+    Name of the script that defines ``obj``, for table headers.
+    """
+    return os.path.basename(sys.modules[obj.__module__].__file__)
+
+
+def source_path(filename):
+    """
+    Absolute path of a file relative to doc/source.
+    """
+    stem = os.getcwd().split("source")[0]
+    return os.path.join(stem, "source", filename)
+
+
+def write_table(path, lines, headings=(), include_table=False, generator=""):
+    """
+    Write a generated table to ``path`` if it has changed.
+    Returns whether the file was written.
+    """
+    record_output(path)
+    with ChangedFileWriter(path) as f:
+        f.write(f"..\n    Generated by {generator}\n\n")
+        indent = ""
+        if include_table:
+            f.write(f".. table:: {include_table}\n\n")
+            indent = "    "
+        if not write_rst_table(f, lines, headings, indent=indent):
+            tabled = tabulate.tabulate(lines, headers=headings, tablefmt="rst")
+            f.write(textwrap.indent(tabled, indent))
+    return f.changed
+
 
 class TableWriter(object):
     """
     For writing tables with easy column switching.
 
-    Define _set_up_input() and column methods.
+    Define _set_up_input() and column methods. Each column is computed
+    over all rows in one go, and only once a heading, a postprocess
+    column or another column needs it. Column methods are called with
+    the input of one row and can look up the value of another column
+    for that row with ``self.value(name)``.
 
     Filename relative to source.
     """
@@ -26,62 +249,99 @@ class TableWriter(object):
     sort = True
 
     def __getattr__(self, key: str) -> list:
+        # private names are never columns, and looking them up as columns
+        # would recurse through _evaluate_column
+        if key.startswith("_"):
+            raise AttributeError(key)
         return self.fields[key]
 
     def __init__(self, *args, **kwargs):
-        stem = os.getcwd().split("source")[0]
-        self.path = os.path.join(stem, "source", self.filename)
-        self.fields = defaultdict(list)
+        self.path = source_path(self.filename)
+        self.inputs = []
+        self.fields = Columns(self._evaluate_column)
+        self._row = None
+        self._evaluating = set()
 
         parent_directory = pathlib.Path(self.path).parent
         parent_directory.mkdir(exist_ok=True, parents=True)
         self.get_lines(*args, **kwargs)
         self.write_table()
 
-    def _run_method(self, method, *args, **kwargs):
-        sanitized = self.sanitize_name(method)
-        meth = getattr(self, sanitized)
-        val = meth(*args, **kwargs)
-        self.fields[method].append(val)
-        return val
+    @classmethod
+    def _column_method(cls, name):
+        """
+        Name of the method that computes a column, resolved once per class.
+        """
+        # look in this class only, not in the cache of a parent class
+        cache = cls.__dict__.get("_column_methods")
+        if cache is None:
+            cache = cls._column_methods = {}
+        try:
+            return cache[name]
+        except KeyError:
+            method = cache[name] = cls.sanitize_name(name)
+            return method
+
+    def _evaluate_column(self, name):
+        if name in self._evaluating:
+            raise ValueError(f"Column {name!r} depends on itself")
+        method = self._column_method(name)
+        if not hasattr(type(self), method):
+            raise AttributeError(f"no column method {method!r}")
+        method = getattr(self, method)
+        self._evaluating.add(name)
+        row = self._row
+        values = []
+        try:
+            for self._row, args in enumerate(self.inputs):
+                values.append(method(*args))
+        finally:
+            self._row = row
+            self._evaluating.discard(name)
+        return values
+
+    def value(self, name):
+        """
+        Value of another column for the row currently being computed.
+        """
+        return self.fields[name][self._row]
 
     @staticmethod
     def sanitize_name(name):
         return "_" + name.replace(" ", "_").replace("/", "_").lower()
 
+    @staticmethod
+    def _as_args(items):
+        try:
+            return tuple(items)
+        except TypeError:  # one argument
+            return (items,)
+
     def get_lines(self, *args, **kwargs):
-        lines = []
-        for items in self._set_up_input():
-            try:
-                lines.append(self.get_line(*items))
-            except TypeError:  # one argument
-                lines.append(self.get_line(items))
+        self.inputs = [self._as_args(items) for items in self._set_up_input()]
+        columns = [self.fields[h] for h in self.headings]
+        for p in self.postprocess:
+            self.fields[p]
+        if columns:
+            lines = [list(line) for line in zip(*columns)]
+        else:
+            lines = [[] for _ in self.inputs]
         if self.sort:
             lines = sorted(lines)
         self.lines = lines
 
-    def get_line(self, *args):
-        line = []
-        for p in self.preprocess:
-            self._run_method(p, *args)
-        for h in self.headings:
-            line.append(self._run_method(h, *args))
-        for p in self.postprocess:
-            self._run_method(p, *args)
-        return line
-
     def write_table(self):
-        with open(self.path, "w") as f:
-            f.write(f'..\n    Generated by {sys.argv[0].split("/")[-1]}\n\n')
-            if self.include_table:
-                f.write(f".. table:: {self.include_table}\n\n")
-            tabled = tabulate.tabulate(
-                self.lines, headers=self.headings, tablefmt="rst"
-            )
-            if self.include_table:
-                tabled = textwrap.indent(tabled, "    ")
-            f.write(tabled)
-        print("Wrote ", self.filename)
+        changed = write_table(
+            self.path,
+            self.lines,
+            self.headings,
+            include_table=self.include_table,
+            generator=generated_by(type(self)),
+        )
+        if changed:
+            print("Wrote ", self.filename)
+        else:
+            print("Unchanged ", self.filename)
 
     # ==== HELPER FUNCTIONS ==== #
 
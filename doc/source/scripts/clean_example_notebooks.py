@@ -16,36 +16,223 @@ To run::
 
     ./clean_example_notebooks.py *.ipynb -vvv
 
+Notebooks are independent of each other, so they can be executed
+in parallel worker processes::
+
+    ./clean_example_notebooks.py *.ipynb -vvv --jobs 4
+
+The notebooks that took longest to execute in the last execution
+profile (see below) are started first, and those never profiled
+before all others, so that a long notebook is not left running alone
+at the end of the run.
+
+Each cell may run for up to 600 seconds. A notebook can change this
+with the same metadata used by MyST-NB, e.g. for up to 30 minutes per
+cell, or no limit with -1::
+
+    "metadata": {"execution": {"timeout": 1800}, ...}
+
+Executed outputs are cached in ``.notebook_cache``, keyed by the code
+cells, the MDAnalysis and MDAnalysisTests versions and the kernel.
+Notebooks whose code has not changed are not executed again; their
+references and Last executed line are still updated. Use ``--force``
+to execute every notebook regardless.
+
+The execution key of a notebook is also recorded in its metadata when
+it is cleaned. If only markdown cells have changed since, the outputs
+in the notebook are still current, so only the references are
+rewritten and no kernel is started. Use ``--refs-only`` to only
+rewrite references, without executing any notebook::
+
+    ./clean_example_notebooks.py *.ipynb --refs-only
+
+The wall time, kernel peak RSS and output size of each executed cell
+are recorded in ``execution_profile.json`` and ``execution_profile.csv``
+in the directory containing the notebooks, including the cell that
+raised an error or timed out. Notebooks that are not executed keep
+their previous entries. To list the slowest cells and
+notebooks from the report, without cleaning anything::
+
+    ./clean_example_notebooks.py ../examples/*/*.ipynb --summary 20
+
+Each notebook is executed in a new kernel by default. With
+``--reuse-kernels``, every process keeps one kernel running, with
+MDAnalysis, numpy, matplotlib and the MDAnalysisTests datafiles
+already imported, and resets its namespace between notebooks::
+
+    ./clean_example_notebooks.py *.ipynb --jobs 4 --reuse-kernels
+
+Progress is recorded in ``.clean_journal.json``, in the directory
+containing the notebooks, as each notebook finishes: whether it was
+executed (done), failed, or only had its references updated
+(skipped), a hash of the notebook before cleaning and after, and how
+long it took. Each run starts a new journal. With ``--resume``,
+notebooks already done or skipped in the journal, and not changed
+since, are not cleaned again, so an interrupted or failed run can be
+continued::
+
+    ./clean_example_notebooks.py *.ipynb --jobs 4 --resume
+
+After execution, PNGs are recompressed and figures wider than
+``--max-figure-width`` are downsampled (both need Pillow). Outputs can
+also be kept within a size budget per cell (``--cell-budget``) and per
+notebook (``--notebook-budget``), both off by default: the largest
+images left over budget are moved to ``_static/notebook_outputs`` and
+linked from the notebook. As the link is not an output a fresh run
+produces, cells with moved images are tagged ``nbval-ignore-output``
+so that the notebook tests still pass::
+
+    ./clean_example_notebooks.py *.ipynb --cell-budget 256 --notebook-budget 1024
+
+What was trimmed is listed at the end.
+
 References
 ==========
 
 This script uses the sphinxcontrib-bibtex extension for references.
+The parsed bibliography, with the inline citations, DOIs and rendered
+HTML of the entries, is cached in ``.notebook_cache`` and only parsed
+again when references.bib changes. Each entry is rendered at most once
+per run, however many notebooks cite it.
 """
 
 import argparse
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import csv
 import datetime
 import glob
+import hashlib
+import importlib.metadata
+import io
+import json
 import logging
+import multiprocessing.util
 import os
+import pickle
 import re
 import shutil
 import sys
+import time
 
 import MDAnalysis as mda
 import nbformat
 import pybtex as tex
 import pybtex.plugin
+from jupyter_client.manager import AsyncKernelManager
+from jupyter_client.utils import run_sync
 from nbconvert.preprocessors import ExecutePreprocessor
 from pybtex.database import BibliographyData, parse_file
 from pybtex.style import formatting
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 parser = argparse.ArgumentParser(description="Clean Jupyter notebooks.")
 parser.add_argument("files", type=str, nargs="+", help="notebook files")
 parser.add_argument("-v", "--verbose", action="count", default=0)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    default=1,
+    help="number of notebooks to execute in parallel (0: one per CPU)",
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="execute notebooks even if cached outputs are available",
+)
+parser.add_argument(
+    "--cache-size",
+    type=int,
+    default=1024,
+    help="maximum size of the execution cache in MB",
+)
+parser.add_argument(
+    "--refs-only",
+    action="store_true",
+    help="only rewrite references, without executing notebooks",
+)
+parser.add_argument(
+    "--summary",
+    type=int,
+    nargs="?",
+    const=20,
+    metavar="N",
+    help="list the N slowest cells and notebooks in the execution profile",
+)
+parser.add_argument(
+    "--reuse-kernels",
+    action="store_true",
+    help="keep one warm kernel per process instead of one per notebook",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="skip notebooks already cleaned in the journal of the last run",
+)
+parser.add_argument(
+    "--cell-budget",
+    type=int,
+    default=0,
+    help="move images out of cells with outputs over this many KB (0: never)",
+)
+parser.add_argument(
+    "--notebook-budget",
+    type=int,
+    default=0,
+    help="move images out of notebooks with outputs over this many KB (0: never)",
+)
+parser.add_argument(
+    "--max-figure-width",
+    type=int,
+    default=1600,
+    help="downsample PNG figures wider than this many pixels (0: never)",
+)
 
 
 logger = logging.getLogger(__name__)
 
+# doc/source
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def trie_pattern(keys):
+    """
+    Build a regular expression that matches any of ``keys``.
+
+    The keys are arranged in a trie, so the alternatives at each
+    character are distinct and the regex engine never backtracks into
+    a shared prefix. Matching is linear in the length of the text,
+    however many keys there are. Where one key is a prefix of another,
+    the longer key wins.
+    """
+    trie = {}
+    for key in keys:
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[None] = True
+    if not trie:
+        return "(?!)"
+    return _trie_node_pattern(trie)
+
+
+def _trie_node_pattern(node):
+    chars = sorted(char for char in node if char is not None)
+    branches = [re.escape(char) + _trie_node_pattern(node[char]) for char in chars]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:{})".format("|".join(branches))
+    if None in node:
+        pattern = "(?:{})?".format(pattern)
+    return pattern
+
 
 class References:
     """
@@ -55,26 +242,100 @@ class References:
     style_name = "plain"
     template = "[{i}] {html}"
     ref_header = "## References"
+    # number of rendered entries kept in memory
+    max_rendered = 1024
 
-    def __init__(self, filename="../references.bib"):
-        logger.info("Reading references from {}".format(filename))
-        self.data = parse_file(filename)
-        logger.info(self.data.entries.keys())
-
+    def __init__(self, filename="../references.bib", cache_dir=None):
         # set up bibliography formatting
         self.style = pybtex.plugin.find_plugin(
             "pybtex.style.formatting", self.style_name
         )()
         self.backend = pybtex.plugin.find_plugin("pybtex.backends", "html")()
 
-        # set up inline reference and doi dictionaries
-        entries = self.data.entries
-        self.inline = {k: self._parse_entry(v) for k, v in entries.items()}
-        self.doi = {k: self._get_doi(v) for k, v in entries.items()}
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(__file__), ".notebook_cache")
+        with open(filename, "rb") as f:
+            key = self.cache_key(f.read())
+        self.cache_path = os.path.join(cache_dir, "references-{}.pickle".format(key))
+
+        cached = self._load(self.cache_path)
+        if cached is None:
+            logger.info("Reading references from {}".format(filename))
+            cached = self._parse(filename)
+            self._save(self.cache_path, cached)
+        else:
+            logger.info("Loaded cached references for {}".format(filename))
+        self.data = cached["data"]
+        self.inline = cached["inline"]
+        self.doi = cached["doi"]
+        # rendered HTML of each entry, least recently used first
+        self.html = collections.OrderedDict(cached["html"])
+        self.rendered = False
+        logger.info(self.data.entries.keys())
 
         # set up key regex
-        pattern = "(" + ")|(".join(self.data.entries.keys()) + ")"
-        self.regex = re.compile(pattern)
+        self.regex = re.compile(trie_pattern(self.data.entries.keys()))
+
+    def cache_key(self, contents):
+        """
+        Hash the .bib file together with what it is formatted with.
+        """
+        data = [tex.__version__, self.style_name]
+        data = json.dumps(data).encode("utf-8") + contents
+        return hashlib.sha256(data).hexdigest()
+
+    def _parse(self, filename):
+        """
+        Parse the bibliography and format the inline citations.
+        Entries are only rendered when they are cited.
+        """
+        data = parse_file(filename)
+        entries = data.entries
+        return {
+            "data": data,
+            "inline": {k: self._parse_entry(v) for k, v in entries.items()},
+            "doi": {k: self._get_doi(v) for k, v in entries.items()},
+            "html": {},
+        }
+
+    def save(self):
+        """
+        Add the entries rendered since the cache was read to the cache.
+        """
+        if not self.rendered:
+            return
+        cached = {
+            "data": self.data,
+            "inline": self.inline,
+            "doi": self.doi,
+            "html": dict(self.html),
+        }
+        self._save(self.cache_path, cached)
+        self.rendered = False
+
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+
+    @staticmethod
+    def _save(path, cached):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # caches of previous versions of the .bib file
+        for old in glob.glob(os.path.join(directory, "references-*.pickle")):
+            if old != path:
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
 
     def write_bibliography(self, keys=[]):
         """
@@ -82,12 +343,31 @@ class References:
         Output is in HTML.
         """
         bibs = [self.ref_header]
-        entries = [self.data.entries[k] for k in keys]
-        for i, entry in enumerate(self.style.format_entries(entries), 1):
-            html = entry.text.render(self.backend)
-            bibs.append(self.template.format(i=i, html=html))
+        # ordered the same way as style.format_entries
+        entries = self.style.sort([self.data.entries[k] for k in keys])
+        for i, entry in enumerate(entries, 1):
+            bibs.append(self.template.format(i=i, html=self.render(entry)))
         return "\n\n".join(bibs)
 
+    def render(self, entry):
+        """
+        Return the HTML of an entry, rendering it only if it has not
+        been rendered before. At most ``max_rendered`` entries are kept,
+        dropping the least recently used.
+        """
+        try:
+            self.html.move_to_end(entry.key)
+            return self.html[entry.key]
+        except KeyError:
+            pass
+        # the label is not part of the rendered text
+        formatted = self.style.format_entry("", entry)
+        html = self.html[entry.key] = formatted.text.render(self.backend)
+        self.rendered = True
+        while len(self.html) > self.max_rendered:
+            self.html.popitem(last=False)
+        return html
+
     def _get_doi(self, entry):
         try:
             return "https://doi.org/{}".format(entry.fields["doi"])
@@ -107,6 +387,582 @@ class References:
         return inline
 
 
+class ExecutionCache:
+    """
+    On-disk cache of executed code cell outputs.
+
+    Entries are keyed by a hash of the code cell sources and the
+    execution environment. Least recently used entries are evicted
+    once the cache grows beyond ``max_size`` bytes.
+    """
+
+    def __init__(self, directory=None, max_size=1024 * 1024**2):
+        if directory is None:
+            directory = os.path.join(os.path.dirname(__file__), ".notebook_cache")
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(cells, environment):
+        """
+        Hash the sources of code cells together with the environment
+        they are executed in.
+        """
+        sources = [c["source"] for c in cells if c["cell_type"] == "code"]
+        data = json.dumps([sources, environment], sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """
+        Return the cached outputs of each code cell, or None.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                outputs = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # mark as recently used
+        os.utime(path)
+        return outputs
+
+    def put(self, key, cells):
+        """
+        Store the outputs and execution counts of executed code cells.
+        """
+        outputs = [
+            {"outputs": c["outputs"], "execution_count": c["execution_count"]}
+            for c in cells
+            if c["cell_type"] == "code"
+        ]
+        path = self._path(key)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(outputs, f)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:  # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            logger.info("Evicting {} from execution cache".format(name))
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def peak_rss(pid):
+    """
+    Peak resident set size of a process in MB, or None if it cannot be
+    read. Only supported on Linux.
+    """
+    try:
+        with open("/proc/{}/status".format(pid), "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def reset_peak_rss(pid):
+    """
+    Reset the peak resident set size of a process to its current RSS.
+    Only supported on Linux.
+    """
+    try:
+        with open("/proc/{}/clear_refs".format(pid), "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class ProfilingExecutePreprocessor(ExecutePreprocessor):
+    """
+    Executes a notebook, recording the wall time, the peak RSS of the
+    kernel and the size of the outputs of each code cell. The peak RSS
+    is reset before each cell, so it is the peak while that cell ran.
+    A cell that raises or times out is recorded with ``error`` set to
+    the name of the exception or ``"timeout"``.
+    """
+
+    def __init__(self, **kwargs):
+        super(ProfilingExecutePreprocessor, self).__init__(**kwargs)
+        self.cell_profiles = []
+
+    def kernel_pid(self):
+        try:
+            return self.km.provisioner.process.pid
+        except AttributeError:
+            return None
+
+    def kernel_peak_rss(self):
+        pid = self.kernel_pid()
+        return None if pid is None else peak_rss(pid)
+
+    def preprocess_cell(self, cell, resources, index):
+        pid = self.kernel_pid()
+        if cell.cell_type == "code" and pid is not None:
+            reset_peak_rss(pid)
+        start = time.perf_counter()
+        error = None
+        try:
+            cell, resources = super(ProfilingExecutePreprocessor, self).preprocess_cell(
+                cell, resources, index
+            )
+        except TimeoutError:
+            error = "timeout"
+            raise
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            # also record the cells that fail or time out
+            if cell.cell_type == "code":
+                self.cell_profiles.append(
+                    {
+                        "cell": index,
+                        "wall_time": time.perf_counter() - start,
+                        "peak_rss_mb": self.kernel_peak_rss(),
+                        "output_size": len(json.dumps(cell.get("outputs", []))),
+                        "source": cell.source.split("\n")[0][:80],
+                        "error": error,
+                    }
+                )
+        return cell, resources
+
+
+class KernelPool:
+    """
+    Keeps a kernel running between the notebooks executed in a
+    process, so that starting it and importing the ``preload`` modules
+    is paid once per process rather than once per notebook.
+
+    Before each notebook the kernel's namespace is reset, figures are
+    closed, the working directory and execution count are restored
+    and the kernel's peak RSS is reset. Module-level state, e.g. of
+    matplotlib, is not reset. A kernel that failed or died is shut
+    down and a new one is started for the next notebook.
+    """
+
+    preload = (
+        "MDAnalysis",
+        "MDAnalysisTests.datafiles",
+        "numpy",
+        "matplotlib.pyplot",
+    )
+    timeout = 600
+
+    def __init__(self, kernel_name, preload=None):
+        self.kernel_name = kernel_name
+        if preload is not None:
+            self.preload = preload
+        self.cwd = os.getcwd()
+        self.km = None
+
+    def __getstate__(self):
+        # running kernels are not shared with other processes
+        return dict(self.__dict__, km=None)
+
+    def _run(self, code):
+        kc = self.km.blocking_client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=self.timeout)
+            reply = kc.execute_interactive(
+                code, silent=True, store_history=False, timeout=self.timeout
+            )
+        finally:
+            kc.stop_channels()
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(
+                "Could not set up kernel: {}".format(reply["content"].get("evalue"))
+            )
+
+    def _start(self):
+        logger.info("   Starting kernel {}".format(self.kernel_name))
+        self.km = AsyncKernelManager(kernel_name=self.kernel_name)
+        run_sync(self.km.start_kernel)(
+            cwd=self.cwd, extra_arguments=["--HistoryManager.hist_file=:memory:"]
+        )
+        # shut down when the (worker) process exits
+        multiprocessing.util.Finalize(self, self.discard, exitpriority=10)
+        self._run(
+            "import importlib\n"
+            "for _name in {!r}:\n"
+            "    try:\n"
+            "        importlib.import_module(_name)\n"
+            "    except ImportError:\n"
+            "        pass\n".format(self.preload)
+        )
+
+    def _reset(self):
+        self._run(
+            "import os\n"
+            "os.chdir({!r})\n"
+            "try:\n"
+            "    import matplotlib.pyplot\n"
+            "    matplotlib.pyplot.close('all')\n"
+            "except ImportError:\n"
+            "    pass\n"
+            "try:\n"
+            "    with open('/proc/self/clear_refs', 'w') as f:\n"
+            "        f.write('5')\n"
+            "except OSError:\n"
+            "    pass\n"
+            "get_ipython().run_line_magic('reset', '-f')\n"
+            "get_ipython().execution_count = 1\n".format(self.cwd)
+        )
+
+    def get(self):
+        """
+        Return the manager of a kernel ready to execute a notebook.
+        """
+        if self.km is not None and not run_sync(self.km.is_alive)():
+            self.discard()
+        if self.km is None:
+            self._start()
+        self._reset()
+        return self.km
+
+    def discard(self):
+        """
+        Shut down the kernel.
+        """
+        if self.km is None:
+            return
+        try:
+            run_sync(self.km.shutdown_kernel)(now=True)
+        except RuntimeError:
+            pass
+        self.km = None
+
+
+class ExecutionProfile:
+    """
+    Report of the execution time, kernel peak RSS and output size of
+    each notebook and cell, written as JSON and CSV.
+    """
+
+    filename = "execution_profile"
+    csv_fields = (
+        "notebook",
+        "cell",
+        "wall_time",
+        "peak_rss_mb",
+        "output_size",
+        "source",
+        "error",
+    )
+
+    def __init__(self, notebooks):
+        directories = [os.path.dirname(os.path.abspath(n)) for n in notebooks]
+        self.directory = os.path.commonpath(directories)
+        self.json_path = os.path.join(self.directory, self.filename + ".json")
+        self.csv_path = os.path.join(self.directory, self.filename + ".csv")
+        try:
+            with open(self.json_path, "r") as f:
+                self.notebooks = json.load(f)
+        except (OSError, ValueError):
+            self.notebooks = {}
+        self.updated = False
+
+    def update(self, filename, profile):
+        name = os.path.relpath(os.path.abspath(filename), self.directory)
+        self.notebooks[name] = profile
+        self.updated = True
+
+    def estimate(self, filename):
+        """
+        Return how long the notebook took to execute last time, or
+        None if it has not been executed before.
+        """
+        name = os.path.relpath(os.path.abspath(filename), self.directory)
+        profile = self.notebooks.get(name)
+        return None if profile is None else profile["wall_time"]
+
+    def write(self):
+        with open(self.json_path, "w") as f:
+            json.dump(self.notebooks, f, indent=1, sort_keys=True)
+        with open(self.csv_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.csv_fields)
+            writer.writeheader()
+            for name, profile in sorted(self.notebooks.items()):
+                for cell in profile["cells"]:
+                    writer.writerow(dict(cell, notebook=name))
+        logger.info("Wrote execution profile to {}".format(self.json_path))
+
+    def summary(self, n=20):
+        """
+        Format the n slowest notebooks and cells.
+        """
+        lines = ["Slowest notebooks:"]
+        notebooks = sorted(self.notebooks.items(), key=lambda x: -x[1]["wall_time"])
+        for name, profile in notebooks[:n]:
+            lines.append(
+                "{:>9.1f}s {:>9} MB {:>9} B  {}".format(
+                    profile["wall_time"],
+                    _format_rss(profile["peak_rss_mb"]),
+                    profile["output_size"],
+                    name,
+                )
+            )
+        lines.append("Slowest cells:")
+        cells = [
+            dict(cell, notebook=name)
+            for name, profile in self.notebooks.items()
+            for cell in profile["cells"]
+        ]
+        for cell in sorted(cells, key=lambda x: -x["wall_time"])[:n]:
+            lines.append(
+                "{:>9.1f}s {:>9} MB {:>9} B  {}[{}]: {}{}".format(
+                    cell["wall_time"],
+                    _format_rss(cell["peak_rss_mb"]),
+                    cell["output_size"],
+                    cell["notebook"],
+                    cell["cell"],
+                    cell["source"],
+                    " ({})".format(cell["error"]) if cell.get("error") else "",
+                )
+            )
+        return "\n".join(lines)
+
+
+class RunJournal:
+    """
+    Record of the status of each notebook in a run, written as each
+    notebook finishes so that an interrupted run can be resumed.
+    """
+
+    filename = ".clean_journal.json"
+    finished = ("done", "skipped")
+
+    def __init__(self, notebooks, resume=False):
+        directories = [os.path.dirname(os.path.abspath(n)) for n in notebooks]
+        self.directory = os.path.commonpath(directories)
+        self.path = os.path.join(self.directory, self.filename)
+        self.notebooks = {}
+        if resume:
+            try:
+                with open(self.path, "r") as f:
+                    self.notebooks = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def _name(self, filename):
+        return os.path.relpath(os.path.abspath(filename), self.directory)
+
+    def is_finished(self, filename):
+        """
+        Whether the notebook was done or skipped, and has not changed
+        since.
+        """
+        entry = self.notebooks.get(self._name(filename))
+        if entry is None or entry["status"] not in self.finished:
+            return False
+        return hash_notebook(filename) == entry["output_hash"]
+
+    def record(self, filename, entry):
+        self.notebooks[self._name(filename)] = entry
+        tmp = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self.notebooks, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def hash_notebook(filename):
+    try:
+        with open(filename, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _format_rss(rss):
+    return "?" if rss is None else "{:.0f}".format(rss)
+
+
+class OutputBudget:
+    """
+    Keeps the outputs of executed notebooks within a size budget.
+
+    Every PNG output is recompressed, and downsampled if it is wider
+    than ``max_width``. While a cell's outputs are larger than
+    ``cell_budget`` bytes, or all outputs of the notebook are larger
+    than ``notebook_budget`` bytes, the largest image is moved to a
+    file under ``directory`` and replaced with an HTML link to it, and
+    the cell is tagged so that nbval does not compare its outputs.
+    Budgets of 0 mean no limit. Sizes are those of the JSON in the
+    notebook.
+    """
+
+    ignore_tag = "nbval-ignore-output"
+
+    images = {"image/png": "png", "image/jpeg": "jpg", "image/gif": "gif"}
+
+    def __init__(
+        self,
+        cell_budget=0,
+        notebook_budget=0,
+        max_width=1600,
+        directory=None,
+    ):
+        if directory is None:
+            directory = os.path.join(SOURCE_DIR, "_static", "notebook_outputs")
+        self.cell_budget = cell_budget
+        self.notebook_budget = notebook_budget
+        self.max_width = max_width
+        self.directory = os.path.normpath(directory)
+
+    @staticmethod
+    def size(outputs):
+        return len(json.dumps(outputs))
+
+    def apply(self, filename, cells):
+        """
+        Trim the outputs of the code cells of a notebook in place.
+        Returns a list of what was trimmed.
+        """
+        filename = os.path.abspath(filename)
+        name = os.path.splitext(os.path.relpath(filename, SOURCE_DIR))[0]
+        directory = os.path.join(self.directory, name)
+
+        trimmed = []
+        code_cells = [(i, c) for i, c in enumerate(cells) if c["cell_type"] == "code"]
+        for i, cell in code_cells:
+            for output in cell.get("outputs", []):
+                trimmed.extend(self._shrink_png(i, output))
+
+        if self.cell_budget:
+            for i, cell in code_cells:
+                while self.size(cell.get("outputs", [])) > self.cell_budget:
+                    moved = self._move_largest([(i, cell)], directory, filename)
+                    if moved is None:
+                        break
+                    trimmed.append(moved)
+
+        if self.notebook_budget:
+            while (
+                sum(self.size(c.get("outputs", [])) for _, c in code_cells)
+                > self.notebook_budget
+            ):
+                moved = self._move_largest(code_cells, directory, filename)
+                if moved is None:
+                    break
+                trimmed.append(moved)
+
+        self._remove_unused(directory, cells)
+        return trimmed
+
+    def _shrink_png(self, i, output):
+        data = output.get("data", {})
+        if Image is None or "image/png" not in data:
+            return []
+        before = data["image/png"]
+        action = "recompressed"
+        buffer = io.BytesIO()
+        try:
+            with Image.open(io.BytesIO(base64.b64decode(before))) as image:
+                if self.max_width and image.width > self.max_width:
+                    height = round(image.height * self.max_width / image.width)
+                    image = image.resize((self.max_width, height), Image.LANCZOS)
+                    action = "downsampled to {} px wide".format(self.max_width)
+                image.save(buffer, format="PNG", optimize=True)
+        except (OSError, ValueError) as err:
+            logger.info("   Could not recompress PNG in cell {}: {}".format(i, err))
+            return []
+        after = base64.b64encode(buffer.getvalue()).decode("ascii") + "\n"
+        if len(after) >= len(before):
+            return []
+        data["image/png"] = after
+        return [
+            {
+                "cell": i,
+                "mimetype": "image/png",
+                "action": action,
+                "before": len(before),
+                "after": len(after),
+            }
+        ]
+
+    def _move_largest(self, cells, directory, filename):
+        """
+        Move the largest image in ``cells`` to a file. Returns what was
+        moved, or None if there are no images left to move.
+        """
+        candidates = []
+        for i, cell in cells:
+            for output in cell.get("outputs", []):
+                data = output.get("data", {})
+                # an existing HTML representation would be shown instead
+                if "text/html" in data:
+                    continue
+                for mimetype in self.images:
+                    if mimetype in data:
+                        candidates.append(
+                            (len(data[mimetype]), i, cell, mimetype, data)
+                        )
+        if not candidates:
+            return None
+        before, i, cell, mimetype, data = max(candidates, key=lambda x: x[0])
+
+        contents = base64.b64decode(data.pop(mimetype))
+        digest = hashlib.sha256(contents).hexdigest()[:16]
+        path = os.path.join(directory, digest + "." + self.images[mimetype])
+        if not os.path.exists(path):
+            os.makedirs(directory, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(contents)
+        src = os.path.relpath(path, os.path.dirname(filename))
+        src = src.replace(os.sep, "/")
+        data["text/html"] = '<img src="{}"/>'.format(src)
+        # a fresh run has the image, not the link, so nbval would fail
+        tags = cell.setdefault("metadata", {}).setdefault("tags", [])
+        if self.ignore_tag not in tags:
+            tags.append(self.ignore_tag)
+        return {
+            "cell": i,
+            "mimetype": mimetype,
+            "action": "moved to {}".format(src),
+            "before": before,
+            "after": len(data["text/html"]),
+        }
+
+    def _remove_unused(self, directory, cells):
+        """
+        Remove files moved out of earlier versions of the notebook
+        that are no longer linked from it.
+        """
+        if not os.path.isdir(directory):
+            return
+        contents = json.dumps(cells)
+        for name in os.listdir(directory):
+            if name not in contents:
+                os.remove(os.path.join(directory, name))
+
+
 class JupyterCell:
     """
     Handles each Jupyter cell.
@@ -170,36 +1026,44 @@ class JupyterCell:
         references.
 
         Track the order of the keys for a final bibliography cell.
-        """
-        matches = [x for x in re.split(refs.regex, self.source) if x is not None]
-        new_source = ""
 
-        while len(matches) > 1:
-            key = matches[1]
+        The source is scanned once and rewritten into a list of parts,
+        so the cost is linear in the length of the cell.
+        """
+        parts = []
+        end = 0
+        in_tag = False
+        for match in refs.regex.finditer(self.source):
+            key = match.group()
             if key not in keys:
                 keys.append(key)
 
             authors = refs.inline[key]
             url = refs.doi[key]
 
-            before = matches[0]
-            prev_char = before[-1]
+            before = self.source[end : match.start()]
+            # drop the rest of the tag the previous key was in
+            if in_tag:
+                before = before.split(self.close_tag, maxsplit=1)[-1]
+            prev_char = before[-1:]
+            in_tag = False
             # shorthand
             if prev_char == "#":
-                new_source += before[:-1]
+                parts.append(before[:-1])
             # already in an HTML tag
             elif prev_char in ('"', "'"):
-                new_source += before.rsplit("<", maxsplit=1)[0]
-                if len(matches) > 2:
-                    matches[2] = matches[2].split(self.close_tag, maxsplit=1)[-1]
+                parts.append(before.rsplit("<", maxsplit=1)[0])
+                in_tag = True
             tag = self.tagline.format(key=key, authors=authors, url=url)
-            new_source += tag
-            matches.pop(0)
-            matches.pop(0)
+            parts.append(tag)
+            end = match.end()
 
-        if len(matches):
-            new_source += matches.pop(0)
+        after = self.source[end:]
+        if in_tag:
+            after = after.split(self.close_tag, maxsplit=1)[-1]
+        parts.append(after)
 
+        new_source = "".join(parts)
         self.source = new_source
         self.lines = new_source.split("\n")
 
@@ -218,36 +1082,64 @@ class JupyterCell:
 
 class JupyterNotebook:
     """
-    Handles a Jupyter notebook. It immediately backs up the original to
-    .original, just in case.
+    Handles a Jupyter notebook. The notebook is only rewritten if its
+    contents change, in which case the original is first backed up to
+    a dot-prefixed copy, just in case.
     """
 
     kernel_name = os.environ["CONDA_DEFAULT_ENV"]
+    timeout = 600
     version = mda.__version__
+    try:
+        tests_version = importlib.metadata.version("MDAnalysisTests")
+    except importlib.metadata.PackageNotFoundError:
+        tests_version = None
 
-    def __init__(self, filename, refs):
+    def __init__(
+        self,
+        filename,
+        refs,
+        cache=None,
+        force=False,
+        refs_only=False,
+        budget=None,
+        kernels=None,
+    ):
         logger.info("Operating on notebook {}".format(filename))
-        with open(filename, "r") as f:
-            self.contents = nbformat.reads(f.read(), as_version=4)
+        with open(filename, "rb") as f:
+            data = f.read()
+        self.input_hash = hashlib.sha256(data).hexdigest()
+        self.contents = nbformat.reads(data.decode("utf-8"), as_version=4)
         self.cells = [JupyterCell(**c) for c in self.contents["cells"]]
         self.metadata = self.contents["metadata"]
         self.keys = []
         self.refs = refs
+        self.cache = cache
+        self.force = force
+        self.refs_only = refs_only
+        self.budget = budget
+        self.kernels = kernels
         self.filename = filename
-        # make backup
-        split = filename.split("/")
-        backup_name = "/".join(split[:-1] + ["." + split[-1]])
-        shutil.copyfile(filename, backup_name)
         self.err = None
         self.nglview = False
+        self.executed = False
+        # set if the notebook is executed
+        self.profile = None
+        self.trimmed = []
 
     def clean(self):
         """
         Write references and execute the notebook. If an error is
         raised, save the error. If no error is raised, the notebook
         is overwritten.
+
+        Notebooks are not executed if only references were asked for,
+        or if no code cells have changed since they were last cleaned.
         """
         self.get_references()
+        if self.refs_only or self.is_up_to_date():
+            self.update_references()
+            return
         try:
             self.execute_and_update()
         except Exception as err:
@@ -262,23 +1154,109 @@ class JupyterNotebook:
         for cell in self.cells:
             if cell.cell_type == "markdown":
                 cell.find_reference_keys(self.refs, keys=self.keys)
+        previous = None
         if "## References" in self.cells[-1].source:
-            self.cells = self.cells[:-1]
+            previous = self.cells.pop()
 
         if self.keys:
-            self.cells.append(JupyterCell.as_references(self.refs, self.keys))
+            cell = JupyterCell.as_references(self.refs, self.keys)
+            # keep the id of the cell being replaced, so that an
+            # unchanged bibliography leaves the notebook unchanged
+            if previous is not None and "id" in previous.kwargs:
+                cell.kwargs["id"] = previous.kwargs["id"]
+            self.cells.append(cell)
         self.contents["cells"] = [c.to_dict() for c in self.cells]
         self.contents = nbformat.from_dict(self.contents)
 
+    def update_references(self):
+        """
+        Overwrite the notebook with the new references, keeping the
+        outputs and Last executed line.
+        """
+        logger.info("   Not executing; only updating references")
+        self.contents["metadata"] = self.metadata
+        self.contents = nbformat.from_dict(self.contents)
+        self.write()
+
+    @property
+    def environment(self):
+        return {
+            "mdanalysis": self.version,
+            "mdanalysistests": self.tests_version,
+            "kernel": self.kernel_name,
+        }
+
+    @property
+    def execution_key(self):
+        return ExecutionCache.key(self.contents["cells"], self.environment)
+
+    def is_up_to_date(self):
+        """
+        Whether the code cells and environment are the same as when the
+        notebook was last cleaned, so its outputs are still current.
+        """
+        if self.force:
+            return False
+        return self.metadata.get("execution_key") == self.execution_key
+
+    def execute(self):
+        """
+        Execute the notebook, reusing cached outputs if the code cells
+        and environment have not changed since they were cached.
+        """
+        cells = self.contents["cells"]
+        key = None
+        if self.cache is not None:
+            key = self.execution_key
+            if not self.force:
+                outputs = self.cache.get(key)
+                if outputs is not None:
+                    logger.info("   Using cached outputs")
+                    code_cells = [c for c in cells if c["cell_type"] == "code"]
+                    for cell, output in zip(code_cells, outputs):
+                        cell.update(output)
+                    return
+
+        logger.info("   Executing")
+        self.executed = True
+        # Choosing a kernel name gets me errors?
+        timeout = self.metadata.get("execution", {}).get("timeout", self.timeout)
+        ep = ProfilingExecutePreprocessor(timeout=timeout, kernel_name=self.kernel_name)
+        start = time.perf_counter()
+        km = None
+        try:
+            if self.kernels is not None:
+                km = self.kernels.get()
+            ep.preprocess(self.contents, km=km)
+        except Exception:
+            if self.kernels is not None:
+                self.kernels.discard()
+            raise
+        finally:
+            if km is not None and ep.kc is not None:
+                ep.kc.stop_channels()
+            cells = ep.cell_profiles
+            rss = [c["peak_rss_mb"] for c in cells if c["peak_rss_mb"] is not None]
+            self.profile = {
+                "wall_time": time.perf_counter() - start,
+                "peak_rss_mb": max(rss, default=None),
+                "output_size": sum(c["output_size"] for c in cells),
+                "cells": cells,
+            }
+        if key is not None:
+            self.cache.put(key, self.contents["cells"])
+
     def execute_and_update(self):
         """
         Execute the notebook. Overwrite the notebook if
         """
         original_contents = self.contents
-        logger.info("   Executing")
-        # Choosing a kernel name gets me errors?
-        ep = ExecutePreprocessor(timeout=600, kernel_name=self.kernel_name)
-        ep.preprocess(self.contents)
+        key = self.execution_key
+        self.execute()
+
+        if self.budget is not None:
+            logger.info("   Trimming outputs")
+            self.trimmed = self.budget.apply(self.filename, self.contents["cells"])
 
         logger.info("   Updating last executed")
         # on success, replace Last executed line
@@ -292,28 +1270,214 @@ class JupyterNotebook:
             self.nglview = True
 
         self.contents["cells"][0] = first_cell.to_dict()
+        self.metadata["execution_key"] = key
         self.contents["metadata"] = self.metadata
         self.contents = nbformat.from_dict(self.contents)
+        self.write()
 
+    def write(self):
+        """
+        Replace the notebook if its contents have changed, backing up
+        the original first. The new contents are written to a temporary
+        file that is moved over the notebook, so it is never left half
+        written.
+        """
+        text = nbformat.writes(self.contents)
+        if not text.endswith("\n"):
+            text += "\n"
+        data = text.encode("utf-8")
+        if hashlib.sha256(data).hexdigest() == self.input_hash:
+            logger.info("   Notebook unchanged")
+            return
         logger.info("   Rewriting notebook")
-        with open(self.filename, "w", encoding="utf-8") as f:
-            nbformat.write(self.contents, f)
+        # make backup
+        split = self.filename.split("/")
+        backup_name = "/".join(split[:-1] + ["." + split[-1]])
+        shutil.copyfile(self.filename, backup_name)
+        tmp = "{}.{}.tmp".format(backup_name, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(data)
+        shutil.copymode(self.filename, tmp)
+        os.replace(tmp, self.filename)
+
+
+def clean_notebook(filename, refs, **kwargs):
+    """
+    Clean a single notebook. Returns the filename, the error raised
+    while cleaning (or None), whether it needs re-executing
+    for NGLView, its execution profile (or None if not executed),
+    what outputs were trimmed and its entry in the run journal.
+
+    Errors raised while reading, rewriting references or writing the
+    notebook are returned like execution errors, so that one broken
+    notebook does not stop the run or its journal.
+    """
+    start = time.perf_counter()
+    input_hash = hash_notebook(filename)
+    nglview = False
+    profile = None
+    trimmed = []
+    try:
+        notebook = JupyterNotebook(filename, refs, **kwargs)
+        notebook.clean()
+    except Exception as e:
+        logger.info("   Could not clean {}: {!r}".format(filename, e))
+        # the name bound by except is deleted after the block
+        err = e
+        status = "failed"
+    else:
+        err = notebook.err
+        nglview = notebook.nglview
+        profile = notebook.profile
+        trimmed = notebook.trimmed
+        if err is not None:
+            status = "failed"
+        elif notebook.executed:
+            status = "done"
+        else:
+            status = "skipped"
+    entry = {
+        "status": status,
+        "input_hash": input_hash,
+        "output_hash": hash_notebook(filename),
+        "duration": time.perf_counter() - start,
+    }
+    if err is not None:
+        entry["error"] = str(err)
+    return filename, err, nglview, profile, trimmed, entry
+
+
+# References and notebook options shared by every notebook
+# run in a worker process
+_worker_refs = None
+_worker_kwargs = {}
+
+
+def _init_worker(refs, kwargs):
+    global _worker_refs, _worker_kwargs
+    _worker_refs = refs
+    _worker_kwargs = kwargs
 
 
-def clean_all_notebooks(notebooks):
+def _clean_notebook_in_worker(filename):
+    filename, err, nglview, profile, trimmed, entry = clean_notebook(
+        filename, _worker_refs, **_worker_kwargs
+    )
+    # execution errors do not always survive pickling, so only
+    # send back the message
+    if err is not None:
+        err = str(err)
+    return filename, err, nglview, profile, trimmed, entry
+
+
+async def _schedule_notebooks(notebooks, jobs, refs, kwargs, journal):
+    """
+    Clean notebooks in up to ``jobs`` worker processes, in the order
+    given, recording each in the journal as it finishes. Returns the
+    results in the order given.
+    """
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(refs, kwargs)
+    ) as executor:
+        # the executor starts notebooks in the order they are submitted
+        tasks = [
+            loop.run_in_executor(executor, _clean_notebook_in_worker, nb)
+            for nb in notebooks
+        ]
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            journal.record(result[0], result[-1])
+    return [task.result() for task in tasks]
+
+
+def clean_all_notebooks(
+    notebooks,
+    jobs=1,
+    force=False,
+    cache_size=1024,
+    refs_only=False,
+    budget=None,
+    reuse_kernels=False,
+    resume=False,
+):
     not_backups = [n for n in notebooks if not n.split("/")[-1][0] == "."]
     if not not_backups:
         return
+    journal = RunJournal(not_backups, resume=resume)
+    todo = not_backups
+    if resume:
+        todo = [n for n in not_backups if not journal.is_finished(n)]
+        if len(todo) < len(not_backups):
+            print(
+                "Resuming: {} notebooks already cleaned".format(
+                    len(not_backups) - len(todo)
+                )
+            )
+        if not todo:
+            return
     refs = References()
+    kwargs = dict(
+        cache=ExecutionCache(max_size=cache_size * 1024**2),
+        force=force,
+        refs_only=refs_only,
+        budget=budget,
+    )
+    if reuse_kernels:
+        kwargs["kernels"] = KernelPool(JupyterNotebook.kernel_name)
+    report = ExecutionProfile(not_backups)
+    if jobs < 1:
+        jobs = os.cpu_count()
+    jobs = min(jobs, len(todo))
+
+    results = []
+    if jobs == 1:
+        for nb in todo:
+            results.append(clean_notebook(nb, refs, **kwargs))
+            journal.record(nb, results[-1][-1])
+    else:
+        # references are parsed and rendered once and pickled into
+        # each worker, rather than rendered again in every worker
+        for entry in refs.data.entries.values():
+            refs.render(entry)
+        # longest first, starting with those that have never been run
+        estimates = {nb: report.estimate(nb) for nb in todo}
+        longest_first = sorted(
+            todo,
+            key=lambda nb: (estimates[nb] is not None, -(estimates[nb] or 0)),
+        )
+        results = asyncio.run(
+            _schedule_notebooks(longest_first, jobs, refs, kwargs, journal)
+        )
+        # report in the order of the input notebooks
+        order = {nb: i for i, nb in enumerate(todo)}
+        results.sort(key=lambda result: order[result[0]])
+    refs.save()
+    if reuse_kernels:
+        kwargs["kernels"].discard()
+
     errs = []
     nglview = []
-    for nb in not_backups:
-        notebook = JupyterNotebook(nb, refs)
-        notebook.clean()
-        if notebook.err is not None:
-            errs.append((nb, notebook.err))
-        if notebook.nglview:
+    trimmed = []
+    for nb, err, needs_nglview, profile, trimmed_outputs, _ in results:
+        if err is not None:
+            errs.append((nb, err))
+        if needs_nglview:
             nglview.append(nb)
+        if profile is not None:
+            report.update(nb, profile)
+        for output in trimmed_outputs:
+            trimmed.append(
+                "{}[{cell}] {mimetype} {action}: {before} -> {after} bytes".format(
+                    nb, **output
+                )
+            )
+    if report.updated:
+        report.write()
+
+    if trimmed:
+        print("Trimmed outputs: ")
+        print("\n".join(trimmed))
 
     if nglview:
         print("Re-execute for NGLView: ")
@@ -332,4 +1496,20 @@ if __name__ == "__main__":
         level=level,
         stream=sys.stdout,
     )
-    clean_all_notebooks(args.files)
+    if args.summary is not None:
+        print(ExecutionProfile(args.files).summary(args.summary))
+        sys.exit(0)
+    clean_all_notebooks(
+        args.files,
+        jobs=args.jobs,
+        force=args.force,
+        cache_size=args.cache_size,
+        refs_only=args.refs_only,
+        reuse_kernels=args.reuse_kernels,
+        resume=args.resume,
+        budget=OutputBudget(
+            cell_budget=args.cell_budget * 1024,
+            notebook_budget=args.notebook_budget * 1024,
+            max_width=args.max_figure_width,
+        ),
+    )
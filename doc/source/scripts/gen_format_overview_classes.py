@@ -6,11 +6,13 @@ Generates:
     - ../formats/classes/*.txt : small tables of parser/reader/writer classes for each format
 """
 
+import os
+import pathlib
 from collections import defaultdict
 
-from base import TableWriter
+from base import TableWriter, generated_by, source_path, write_table
 from core import DESCRIPTIONS
-from MDAnalysis import _CONVERTERS, _PARSERS, _READERS, _SINGLEFRAME_WRITERS
+from registries import _CONVERTERS, _PARSERS, _READERS, _SINGLEFRAME_WRITERS
 
 FILE_TYPES = defaultdict(dict)
 
@@ -41,7 +43,7 @@ class FormatOverview(TableWriter):
         return sorted_types
 
     def _file_type(self, fmt, handlers):
-        return self.sphinx_ref(fmt, self.keys[-1], suffix="-format")
+        return self.sphinx_ref(fmt, self.value("keys"), suffix="-format")
 
     def _keys(self, fmt, handlers):
         if fmt in DESCRIPTIONS:
@@ -55,7 +57,7 @@ class FormatOverview(TableWriter):
         return key
 
     def _description(self, fmt, handlers):
-        return DESCRIPTIONS[self.keys[-1]]
+        return DESCRIPTIONS[self.value("keys")]
 
     def _topology(self, fmt, handlers):
         if "Topology parser" in handlers:
@@ -97,25 +99,36 @@ class CoordinateReaders(FormatOverview):
         return FAIL
 
 
-class SphinxClasses(TableWriter):
-    filename = "formats/reference/classes/{}.txt"
+SPHINX_CLASSES = "formats/reference/classes/{}.txt"
 
-    def __init__(self, fmt):
-        self.filename = self.filename.format(fmt)
-        self.fmt = fmt
-        super(SphinxClasses, self).__init__()
 
-    def get_lines(self):
+def write_sphinx_classes(fmts):
+    """
+    Write the small table of parser/reader/writer classes for each
+    format. All tables are built from FILE_TYPES in one pass, and the
+    output directory is only set up once.
+    """
+    directory = source_path(os.path.dirname(SPHINX_CLASSES))
+    pathlib.Path(directory).mkdir(exist_ok=True, parents=True)
+    generator = generated_by(write_sphinx_classes)
+    written = 0
+    fmts = sorted(set(fmts))
+    for fmt in fmts:
         lines = []
-        for label, klass in sorted(FILE_TYPES[self.fmt].items()):
+        for label, klass in sorted(FILE_TYPES[fmt].items()):
             lines.append(
-                ["**{}**".format(label), self.sphinx_class(klass, tilde=False)]
+                ["**{}**".format(label), TableWriter.sphinx_class(klass, tilde=False)]
             )
-        self.lines = lines
+        path = os.path.join(directory, os.path.basename(SPHINX_CLASSES.format(fmt)))
+        written += write_table(path, lines, generator=generator)
+    print("Wrote ", written, "of", len(fmts), "tables in", directory)
 
 
-if __name__ == "__main__":
+def main():
     ov = FormatOverview()
     CoordinateReaders()
-    for key in set(ov.fields["keys"]):
-        SphinxClasses(key)
+    write_sphinx_classes(ov.fields["keys"])
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ Generates:
 """
 
 from base import TableWriter
-from MDAnalysis import _SELECTION_WRITERS
+from registries import _SELECTION_WRITERS
 
 SELECTION_DESCRIPTIONS = {
     "vmd": "VMD macros, available in Representations",
@@ -43,5 +43,9 @@ class SelectionExporterWriter(TableWriter):
         return self.sphinx_class(klass, tilde=False)
 
 
-if __name__ == "__main__":
+def main():
     SelectionExporterWriter()
+
+
+if __name__ == "__main__":
+    main()
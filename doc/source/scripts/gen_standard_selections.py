@@ -9,7 +9,7 @@ Writes standard selection names for:
     - nucleic sugar atoms
 """
 from base import TableWriter
-from MDAnalysis.core import selection as sel
+from registries import selections as sel
 
 
 def chunk_list(lst, n=8):
@@ -34,10 +34,14 @@ class StandardSelectionTable(TableWriter):
         self.lines = table
 
 
-if __name__ == "__main__":
+def main():
     StandardSelectionTable("protein", sel.ProteinSelection, "prot_res", True)
     StandardSelectionTable("protein_backbone", sel.BackboneSelection, "bb_atoms")
     StandardSelectionTable("nucleic", sel.NucleicSelection, "nucl_res")
     StandardSelectionTable("nucleic_backbone", sel.NucleicBackboneSelection, "bb_atoms")
     StandardSelectionTable("base", sel.BaseSelection, "base_atoms")
     StandardSelectionTable("nucleic_sugar", sel.NucleicSugarSelection, "sug_atoms")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,6 @@ from collections import defaultdict
 
 from base import TableWriter
 from core import TOPOLOGY_CLS
-from MDAnalysis.core.groups import GroupBase
 
 
 class TransplantedMethods(TableWriter):
@@ -19,7 +18,7 @@ class TransplantedMethods(TableWriter):
     def _set_up_input(self):
         items = []
         for klass in TOPOLOGY_CLS:
-            for name, method in klass.transplants[GroupBase]:
+            for name, method in klass.transplants:
                 items.append([name, klass, method])
         return [x[1:] for x in sorted(items)]
 
@@ -33,5 +32,9 @@ class TransplantedMethods(TableWriter):
         return klass.attrname
 
 
-if __name__ == "__main__":
+def main():
     TransplantedMethods()
+
+
+if __name__ == "__main__":
+    main()
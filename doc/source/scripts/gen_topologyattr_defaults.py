@@ -7,7 +7,6 @@ A table of whether TopologyAttrs are atomwise, residuewise, or segmentwise, and
 
 from base import TableWriter
 from core import TOPOLOGY_CLS
-from MDAnalysis.core.topologyattrs import AtomAttr, ResidueAttr, SegmentAttr
 
 DEFAULTS = {
     "resids": "continuous sequence from 1 to n_residues",
@@ -34,25 +33,22 @@ class TopologyDefaults(TableWriter):
         try:
             return DEFAULTS[klass.attrname]
         except KeyError:
-            try:
-                return repr(klass._gen_initial_values(1, 1, 1)[0])
-            except NotImplementedError:
+            if klass.default is None:
                 return "No default values"
+            return klass.default
 
     def _level(self, klass):
-        if issubclass(klass, AtomAttr):
-            level = "atom"
-        elif issubclass(klass, ResidueAttr):
-            level = "residue"
-        elif issubclass(klass, SegmentAttr):
-            level = "segment"
-        else:
+        if klass.level is None:
             raise ValueError
-        return level
+        return klass.level
 
     def _type(self, klass):
         return klass.dtype
 
 
-if __name__ == "__main__":
+def main():
     TopologyDefaults()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,8 @@ Generate three tables:
     - topologyattrs.txt: A table of supported formats for non-connectivity attributes.
     - topology_parsers.txt: A table of all formats and the attributes they read and guess
 
-This script imports the testsuite, which tests these.
+The parser tests are read from the snapshot in registries.py, which
+reads them from the source of the testsuite instead of importing it.
 """
 import os
 import sys
@@ -13,58 +14,35 @@ from collections import defaultdict
 
 from base import TableWriter
 from core import DESCRIPTIONS, NON_CORE_ATTRS
-from MDAnalysisTests.topology.base import mandatory_attrs
-from MDAnalysisTests.topology.test_crd import TestCRDParser
-from MDAnalysisTests.topology.test_dlpoly import (
-    TestDLPConfigParser,
-    TestDLPHistoryParser,
-)
-from MDAnalysisTests.topology.test_dms import TestDMSParser
-from MDAnalysisTests.topology.test_fhiaims import TestFHIAIMS
-from MDAnalysisTests.topology.test_gms import GMSBase
-from MDAnalysisTests.topology.test_gro import TestGROParser
-from MDAnalysisTests.topology.test_gsd import TestGSDParser
-from MDAnalysisTests.topology.test_hoomdxml import TestHoomdXMLParser
-from MDAnalysisTests.topology.test_lammpsdata import LammpsBase, TestDumpParser
-from MDAnalysisTests.topology.test_mmtf import TestMMTFParser
-from MDAnalysisTests.topology.test_mol2 import TestMOL2Base
-from MDAnalysisTests.topology.test_pdb import TestPDBParser
-from MDAnalysisTests.topology.test_pdbqt import TestPDBQT
-from MDAnalysisTests.topology.test_pqr import TestPQRParser
-from MDAnalysisTests.topology.test_psf import PSFBase
-from MDAnalysisTests.topology.test_top import TestPRMParser
-from MDAnalysisTests.topology.test_tprparser import TPRAttrs
-from MDAnalysisTests.topology.test_txyz import TestTXYZParser
-from MDAnalysisTests.topology.test_xpdb import TestXPDBParser
-from MDAnalysisTests.topology.test_xyz import XYZBase
+from registries import topology_tests as tests
 
 PARSER_TESTS = (
-    TestCRDParser,
-    TestDLPHistoryParser,
-    TestDLPConfigParser,
-    TestDMSParser,
-    TestFHIAIMS,
-    GMSBase,
-    TestGROParser,
-    TestGSDParser,
-    TestHoomdXMLParser,
-    LammpsBase,
-    TestMMTFParser,
-    TestMOL2Base,
-    TestPDBParser,
-    TestPDBQT,
-    TestPQRParser,
-    PSFBase,
-    TestPRMParser,
-    TPRAttrs,
-    TestTXYZParser,
-    TestXPDBParser,
-    XYZBase,
-    TestDumpParser,
+    tests.test_crd.TestCRDParser,
+    tests.test_dlpoly.TestDLPHistoryParser,
+    tests.test_dlpoly.TestDLPConfigParser,
+    tests.test_dms.TestDMSParser,
+    tests.test_fhiaims.TestFHIAIMS,
+    tests.test_gms.GMSBase,
+    tests.test_gro.TestGROParser,
+    tests.test_gsd.TestGSDParser,
+    tests.test_hoomdxml.TestHoomdXMLParser,
+    tests.test_lammpsdata.LammpsBase,
+    tests.test_mmtf.TestMMTFParser,
+    tests.test_mol2.TestMOL2Base,
+    tests.test_pdb.TestPDBParser,
+    tests.test_pdbqt.TestPDBQT,
+    tests.test_pqr.TestPQRParser,
+    tests.test_psf.PSFBase,
+    tests.test_top.TestPRMParser,
+    tests.test_tprparser.TPRAttrs,
+    tests.test_txyz.TestTXYZParser,
+    tests.test_xpdb.TestXPDBParser,
+    tests.test_xyz.XYZBase,
+    tests.test_lammpsdata.TestDumpParser,
 )
 
 
-MANDATORY_ATTRS = set(mandatory_attrs)
+MANDATORY_ATTRS = set(tests.base.mandatory_attrs)
 
 
 parser_attrs = {}
@@ -73,7 +51,7 @@ parser_attrs = {}
 for p in PARSER_TESTS:
     e, g = set(p.expected_attrs) - MANDATORY_ATTRS, set(p.guessed_attrs)
     # clunky hack for PDB
-    if p is TestPDBParser:
+    if p is tests.test_pdb.TestPDBParser:
         e.add("elements")
     parser_attrs[p.parser] = (e, g)
 
@@ -81,6 +59,7 @@ for p in PARSER_TESTS:
 class TopologyParsers(TableWriter):
     headings = ["Format", "Description", "Attributes read", "Attributes guessed"]
     preprocess = ["keys"]
+    postprocess = ["attrs"]
     filename = "formats/topology_parsers.txt"
     include_table = "Table of supported topology parsers and the attributes read"
     sort = True
@@ -92,11 +71,9 @@ class TopologyParsers(TableWriter):
     def _set_up_input(self):
         return [[x, *y] for x, y in parser_attrs.items()]
 
-    def get_line(self, parser, expected, guessed):
-        line = super(TopologyParsers, self).get_line(parser, expected, guessed)
+    def _attrs(self, parser, expected, guessed):
         for a in expected | guessed:
-            self.attrs[a].add(self.fields["Format"][-1])
-        return line
+            self.attrs[a].add(self.value("Format"))
 
     def _keys(self, parser, *args):
         f = parser.format
@@ -108,11 +85,11 @@ class TopologyParsers(TableWriter):
         return (key, label)
 
     def _description(self, *args):
-        key, label = self.keys[-1]
+        key, label = self.value("keys")
         return DESCRIPTIONS[key]
 
     def _format(self, *args):
-        key, label = self.keys[-1]
+        key, label = self.value("keys")
         return self.sphinx_ref(label, key, suffix="-format")
 
     def _attributes_read(self, parser, expected, guessed):
@@ -158,7 +135,11 @@ class ConnectivityAttrs(TopologyAttrs):
         return inp
 
 
-if __name__ == "__main__":
+def main():
     top = TopologyParsers()
     TopologyAttrs(top.attrs)
     ConnectivityAttrs(top.attrs)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,11 @@
 Writes unit tables
 """
 import pathlib
-import sys
 import textwrap
 
 import tabulate
-from MDAnalysis.units import conversion_factor
+from base import record_output, write_if_changed
+from registries import conversion_factor
 
 
 def write_unit_table(filename):
@@ -22,22 +22,27 @@ def write_unit_table(filename):
     parent_directory.mkdir(exist_ok=True, parents=True)
     filename = parent_directory / filename
 
-    with filename.open("w") as f:
-        f.write(".. Generated by {}\n".format(sys.argv[0]))
-        for data_type, lines in tables:
-            line = "\n" + "-" * len(data_type) + "\n"
-            f.write(line)
-            f.write(data_type.capitalize())
-            f.write(line)
-            f.write("\n\n")
-            f.write(
-                textwrap.indent(
-                    tabulate.tabulate(lines, headers=headings, tablefmt="rst"), "    "
-                )
-            )
-            f.write("\n")
-    print("Wrote ", filename)
+    contents = ".. Generated by {}\n".format(__file__)
+    for data_type, lines in tables:
+        line = "\n" + "-" * len(data_type) + "\n"
+        contents += line
+        contents += data_type.capitalize()
+        contents += line
+        contents += "\n\n"
+        contents += textwrap.indent(
+            tabulate.tabulate(lines, headers=headings, tablefmt="rst"), "    "
+        )
+        contents += "\n"
+    record_output(str(filename))
+    if write_if_changed(filename, contents):
+        print("Wrote ", filename)
+    else:
+        print("Unchanged ", filename)
 
 
-if __name__ == "__main__":
+def main():
     write_unit_table("generated/units_table.txt")
+
+
+if __name__ == "__main__":
+    main()
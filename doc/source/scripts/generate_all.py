@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+Regenerate the tables included in the documentation.
+
+Each ``gen_*.py`` script is only re-run when something it reads has
+changed since it last ran:
+
+    - its own source, and that of the local modules it imports
+      (e.g. base.py, core.py)
+    - the installed MDAnalysis version, and the MDAnalysisTests
+      version if it imports the test suite
+    - the contents of the registries it imports from registries.py,
+      e.g. _READERS, _PARSERS, _TOPOLOGY_ATTRS or the topology tests
+
+What each script read and wrote is recorded in
+``generated/.generate_manifest.json``.
+
+All generators run in this process. The registries are read from the
+snapshot written by registries.py, so MDAnalysis itself is only
+imported if the snapshot is out of date, and MDAnalysisTests is not
+imported at all. ``--force`` also retakes the snapshot.
+
+Each generator module defines a ``main()`` function that writes its
+tables. Generators are independent of each other and can be run in a
+thread pool with ``--jobs``. The time spent importing and running each
+generator is reported at the end.
+
+To run from doc/source::
+
+    python scripts/generate_all.py [--force] [--jobs N]
+"""
+
+import argparse
+import ast
+import concurrent.futures
+import glob
+import hashlib
+import importlib
+import importlib.metadata
+import json
+import os
+import time
+
+from registries import fingerprint, read_snapshot, write_snapshot
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST = "generated/.generate_manifest.json"
+
+parser = argparse.ArgumentParser(description="Regenerate documentation tables.")
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="retake the registries snapshot and re-run every generator",
+)
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    default=1,
+    help="number of generators to run in parallel threads",
+)
+
+
+def get_version(package):
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def hash_file(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_imports(path):
+    """
+    Return the local modules imported by a script, and the
+    (module, name) pairs it imports. Only module-level imports are
+    considered; those in functions are run lazily, if at all.
+    """
+    with open(path, "r") as f:
+        tree = ast.parse(f.read(), filename=path)
+    local = set()
+    imported = set()
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module:
+            if os.path.exists(os.path.join(SCRIPT_DIR, node.module + ".py")):
+                local.add(node.module)
+            for alias in node.names:
+                imported.add((node.module, alias.name))
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                imported.add((alias.name, None))
+    return local, imported
+
+
+def get_inputs(script):
+    """
+    Work out everything a generator reads.
+    """
+    sources = {}
+    imported = set()
+    todo = [script]
+    while todo:
+        path = todo.pop()
+        sources[os.path.basename(path)] = hash_file(path)
+        local, names = get_imports(path)
+        imported |= names
+        for module in local:
+            if module + ".py" not in sources:
+                todo.append(os.path.join(SCRIPT_DIR, module + ".py"))
+
+    packages = {module.split(".")[0] for module, _ in imported}
+    if "registries" in packages:
+        packages.add("MDAnalysis")
+    versions = {}
+    for package in ("MDAnalysis", "MDAnalysisTests"):
+        if package in packages:
+            versions[package] = get_version(package)
+
+    registries = {}
+    for module, name in sorted(imported, key=str):
+        if module == "registries":
+            registries[name] = fingerprint(name)
+
+    return {"sources": sources, "versions": versions, "registries": registries}
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST), exist_ok=True)
+    with open(MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def run_generator(module):
+    """
+    Run a generator and return the files it wrote and how long it took.
+    """
+    from base import collect_outputs
+
+    start = time.perf_counter()
+    with collect_outputs() as outputs:
+        module.main()
+    elapsed = time.perf_counter() - start
+    return [os.path.relpath(x) for x in outputs], elapsed
+
+
+def print_timings(timings):
+    width = max(len(name) for name in timings)
+    print("\n{:<{w}}  {:>8}  {:>8}".format("Generator", "import", "run", w=width))
+    for name, (imported, ran) in timings.items():
+        print("{:<{w}}  {:>7.2f}s  {:>7.2f}s".format(name, imported, ran, w=width))
+    total = sum(sum(x) for x in timings.values())
+    print("{:<{w}}  {:>18.2f}s".format("Total", total, w=width))
+
+
+def generate_all(force=False, jobs=1):
+    timings = {}
+    start = time.perf_counter()
+    snapshot = write_snapshot() if force else read_snapshot()
+    timings["registries"] = (time.perf_counter() - start, 0.0)
+    print("MDAnalysis", snapshot["version"])
+    print("MDAnalysisTests", snapshot["tests_version"])
+
+    manifest = load_manifest()
+    stale = {}
+    for script in sorted(glob.glob(os.path.join(SCRIPT_DIR, "gen_*.py"))):
+        name = os.path.basename(script)
+        inputs = get_inputs(script)
+        record = manifest.get(name)
+        if (
+            not force
+            and record is not None
+            and record["inputs"] == inputs
+            and all(os.path.exists(x) for x in record["outputs"])
+        ):
+            print("Skipping {}: inputs unchanged".format(name))
+            continue
+        stale[name] = inputs
+
+    # import in this thread; only generators that need to run
+    # import their dependencies, e.g. MDAnalysisTests
+    modules = {}
+    for name in stale:
+        start = time.perf_counter()
+        modules[name] = importlib.import_module(name[:-3])
+        timings[name] = (time.perf_counter() - start, 0.0)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        futures = {
+            name: pool.submit(run_generator, mod) for name, mod in modules.items()
+        }
+        for name, future in futures.items():
+            outputs, elapsed = future.result()
+            timings[name] = (timings[name][0], elapsed)
+            manifest[name] = {"inputs": stale[name], "outputs": outputs}
+            save_manifest(manifest)
+
+    print_timings(timings)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    generate_all(force=args.force, jobs=args.jobs)
@@ -0,0 +1,493 @@
+#!/usr/bin/env python
+"""
+Snapshot of the MDAnalysis registries that the table generators read:
+
+    - _READERS, _SINGLEFRAME_WRITERS, _PARSERS, _CONVERTERS
+    - _SELECTION_WRITERS
+    - _TOPOLOGY_ATTRS
+    - units.conversion_factor
+    - the standard residue and atom names of selections
+    - the parser, expected_attrs and guessed_attrs of the topology
+      parser tests in MDAnalysisTests
+
+The snapshot is a JSON file keyed to the installed MDAnalysis and
+MDAnalysisTests versions. It is only retaken automatically when one of
+those versions changes, so it must be refreshed by hand if the
+registries change within one version, e.g. with an editable install
+of MDAnalysis or a plugin that registers new formats.
+
+Generators import the registries from here instead of from MDAnalysis::
+
+    from registries import _READERS, conversion_factor
+
+and only pay for importing MDAnalysis if the snapshot is missing or
+was taken with a different version. The parser tests are read from
+the source of the test modules without importing them, which would
+pull in pytest and the test data. Classes and functions are replaced
+by :class:`Record` objects that carry the attributes the generators
+use, such as ``__module__``, ``__name__``, ``format`` or ``units``.
+
+To (re-)write the snapshot::
+
+    python registries.py
+
+or run ``generate_all.py --force``, which also retakes it.
+"""
+
+import ast
+import functools
+import glob
+import hashlib
+import importlib
+import importlib.metadata
+import importlib.util
+import json
+import os
+
+SNAPSHOT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "generated", ".registries.json"
+)
+
+REGISTRIES = (
+    "_READERS",
+    "_SINGLEFRAME_WRITERS",
+    "_PARSERS",
+    "_CONVERTERS",
+    "_SELECTION_WRITERS",
+    "_TOPOLOGY_ATTRS",
+)
+
+NAMESPACES = ("conversion_factor", "selections", "topology_tests")
+
+TEST_ATTRS = ("expected_attrs", "guessed_attrs")
+
+
+class Record(object):
+    """
+    Stand-in for a class or function from a registry snapshot.
+    """
+
+    def __init__(self, module, name, qualname=None, doc=None, **attrs):
+        self.__module__ = module
+        self.__name__ = name
+        self.__qualname__ = qualname or name
+        self.__doc__ = doc
+        self.__dict__.update(attrs)
+
+    def __repr__(self):
+        return "<Record {}.{}>".format(self.__module__, self.__qualname__)
+
+
+def get_version(package="MDAnalysis"):
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def _describe(obj):
+    return {
+        "module": obj.__module__,
+        "name": obj.__name__,
+        "qualname": obj.__qualname__,
+        "doc": obj.__doc__,
+    }
+
+
+def _describe_class(klass):
+    from MDAnalysis.core.groups import GroupBase
+    from MDAnalysis.core.topologyattrs import (
+        AtomAttr,
+        ResidueAttr,
+        SegmentAttr,
+        TopologyAttr,
+    )
+
+    record = _describe(klass)
+    record["doc"] = None
+    fmt = getattr(klass, "format", None)
+    if isinstance(fmt, str):
+        record["format"] = fmt
+    elif isinstance(fmt, (list, tuple)):
+        record["format"] = list(fmt)
+    ext = getattr(klass, "ext", None)
+    if isinstance(ext, str):
+        record["ext"] = ext
+    units = getattr(klass, "units", None)
+    if isinstance(units, dict):
+        record["units"] = units
+
+    if issubclass(klass, TopologyAttr):
+        record["attrname"] = klass.attrname
+        record["singular"] = klass.singular
+        dtype = getattr(klass, "dtype", None)
+        record["dtype"] = None if dtype is None else str(dtype)
+        for level, base in (
+            ("atom", AtomAttr),
+            ("residue", ResidueAttr),
+            ("segment", SegmentAttr),
+        ):
+            if issubclass(klass, base):
+                record["level"] = level
+                break
+        else:
+            record["level"] = None
+        try:
+            record["default"] = repr(klass._gen_initial_values(1, 1, 1)[0])
+        except NotImplementedError:
+            record["default"] = None
+        record["transplants"] = [
+            [name, _describe(method)]
+            for name, method in klass.transplants.get(GroupBase, [])
+        ]
+    return record
+
+
+def _resolve(dotted):
+    """
+    Import the object at a dotted path, e.g. ``MDAnalysis.topology.X.Y``.
+    """
+    parts = dotted.split(".")
+    for i in range(len(parts), 0, -1):
+        try:
+            obj = importlib.import_module(".".join(parts[:i]))
+        except ImportError:
+            continue
+        for part in parts[i:]:
+            obj = getattr(obj, part)
+        return obj
+    raise ImportError(dotted)
+
+
+class TestModule(object):
+    """
+    Statically evaluates class attributes in a test module's source.
+    Only literals, names, dotted paths and ``+`` are understood;
+    anything else raises ValueError.
+    """
+
+    def __init__(self, package, name, path):
+        self.package = package
+        self.name = name
+        with open(path, "r") as f:
+            tree = ast.parse(f.read(), filename=path)
+        self.imports = {}
+        self.assignments = {}
+        self.classes = {}
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.asname:
+                        self.imports[alias.asname] = alias.name
+                    else:
+                        top = alias.name.split(".")[0]
+                        self.imports[top] = top
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                for alias in node.names:
+                    dotted = "{}.{}".format(node.module, alias.name)
+                    self.imports[alias.asname or alias.name] = dotted
+            elif isinstance(node, ast.Assign):
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        self.assignments[target.id] = node.value
+            elif isinstance(node, ast.ClassDef):
+                self.classes[node.name] = node
+
+    def dotted(self, node):
+        if isinstance(node, ast.Attribute):
+            return "{}.{}".format(self.dotted(node.value), node.attr)
+        if isinstance(node, ast.Name):
+            if node.id in self.imports:
+                return self.imports[node.id]
+            return "{}.{}".format(self.name, node.id)
+        raise ValueError(ast.dump(node))
+
+    def evaluate(self, node):
+        try:
+            return ast.literal_eval(node)
+        except ValueError:
+            pass
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            return self.evaluate(node.left) + self.evaluate(node.right)
+        if isinstance(node, ast.Name) and node.id in self.assignments:
+            return self.evaluate(self.assignments[node.id])
+        if isinstance(node, ast.Name) and node.id in self.imports:
+            module, name = self.imports[node.id].rsplit(".", 1)
+            try:
+                module = self.package.module(module)
+            except KeyError:
+                raise ValueError(self.imports[node.id]) from None
+            return module.variable(name)
+        raise ValueError(ast.dump(node))
+
+    def variable(self, name):
+        try:
+            node = self.assignments[name]
+        except KeyError:
+            raise ValueError("{}.{}".format(self.name, name)) from None
+        return self.evaluate(node)
+
+    def class_attribute(self, klass, attr):
+        """
+        Return the module that assigns ``attr`` for the class, or one
+        of its bases, and the assigned value.
+        """
+        for node in self.classes[klass].body:
+            if isinstance(node, ast.Assign):
+                for target in node.targets:
+                    if isinstance(target, ast.Name) and target.id == attr:
+                        return self, node.value
+        for base in self.classes[klass].bases:
+            dotted = self.dotted(base)
+            module, name = dotted.rsplit(".", 1)
+            try:
+                found = self.package.module(module).class_attribute(name, attr)
+            except KeyError:
+                continue
+            if found is not None:
+                return found
+        return None
+
+
+class TestPackage(object):
+    """
+    The parsed test modules of one MDAnalysisTests subpackage.
+    """
+
+    def __init__(self, package):
+        self.package = package
+        spec = importlib.util.find_spec(package.split(".")[0])
+        self.directory = os.path.join(
+            spec.submodule_search_locations[0], *package.split(".")[1:]
+        )
+        self.modules = {}
+
+    def module(self, name):
+        if name not in self.modules:
+            if not name.startswith(self.package + "."):
+                raise KeyError(name)
+            filename = name[len(self.package) + 1 :] + ".py"
+            path = os.path.join(self.directory, filename)
+            if not os.path.exists(path):
+                raise KeyError(name)
+            self.modules[name] = TestModule(self, name, path)
+        return self.modules[name]
+
+
+def _read_parser_test(module, klass):
+    """
+    Statically read the parser and attributes of a parser test class.
+    Returns None if the class is not a parser test.
+    """
+    test = {}
+    for attr in ("parser",) + TEST_ATTRS:
+        found = module.class_attribute(klass, attr)
+        if found is None:
+            return None
+        test[attr] = found
+    source, node = test["parser"]
+    test["parser"] = source.dotted(node)
+    for attr in TEST_ATTRS:
+        source, node = test[attr]
+        test[attr] = list(source.evaluate(node))
+    return test
+
+
+def _import_parser_test(module, klass):
+    """
+    Import a parser test class that cannot be read statically.
+    """
+    klass = getattr(importlib.import_module(module.name), klass)
+    test = {
+        "parser": "{}.{}".format(klass.parser.__module__, klass.parser.__qualname__)
+    }
+    for attr in TEST_ATTRS:
+        test[attr] = list(getattr(klass, attr))
+    return test
+
+
+def take_parser_tests(classes):
+    """
+    Read the topology parser tests of MDAnalysisTests, by module and
+    class name. Parsers are added to ``classes``.
+    """
+    if importlib.util.find_spec("MDAnalysisTests") is None:
+        return {}
+    package = TestPackage("MDAnalysisTests.topology")
+    base = package.module("MDAnalysisTests.topology.base")
+    tests = {"base": {"mandatory_attrs": list(base.variable("mandatory_attrs"))}}
+    for path in sorted(glob.glob(os.path.join(package.directory, "test_*.py"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        module = package.module("{}.{}".format(package.package, name))
+        for klass in module.classes:
+            try:
+                test = _read_parser_test(module, klass)
+            except ValueError:
+                test = _import_parser_test(module, klass)
+            if test is None:
+                continue
+            parser = _resolve(test["parser"])
+            label = test["parser"] = "{}.{}".format(
+                parser.__module__, parser.__qualname__
+            )
+            if label not in classes:
+                classes[label] = _describe_class(parser)
+            tests.setdefault(name, {})[klass] = dict(
+                test, module=module.name, name=klass
+            )
+    return tests
+
+
+def take_snapshot():
+    """
+    Read the registries from MDAnalysis into a JSON-serializable dict.
+    Each class is stored once and referred to by its qualified name.
+    """
+    import MDAnalysis
+    from MDAnalysis.core import selection
+    from MDAnalysis.units import conversion_factor
+
+    classes = {}
+    registries = {}
+    for name in REGISTRIES:
+        registry = registries[name] = {}
+        for key, klass in getattr(MDAnalysis, name).items():
+            label = "{}.{}".format(klass.__module__, klass.__qualname__)
+            if label not in classes:
+                classes[label] = _describe_class(klass)
+            registry[key] = label
+
+    selections = {}
+    for name, klass in vars(selection).items():
+        if not isinstance(klass, type) or not issubclass(klass, selection.Selection):
+            continue
+        names = {
+            k: list(v)
+            for k, v in vars(klass).items()
+            if isinstance(v, (set, frozenset, list, tuple))
+            and all(isinstance(x, str) for x in v)
+        }
+        if names:
+            selections[name] = dict(_describe(klass), doc=None, **names)
+
+    return {
+        "version": get_version("MDAnalysis"),
+        "tests_version": get_version("MDAnalysisTests"),
+        "classes": classes,
+        "registries": registries,
+        "conversion_factor": conversion_factor,
+        "selections": selections,
+        "topology_tests": take_parser_tests(classes),
+    }
+
+
+def write_snapshot(path=SNAPSHOT):
+    snapshot = take_snapshot()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        # keep the order of MDAnalysis, e.g. of the conversion_factor
+        # sections, which the tables are written in
+        json.dump(snapshot, f, separators=(",", ":"))
+    os.replace(tmp, path)
+    print("Wrote ", os.path.relpath(path))
+    read_snapshot.cache_clear()
+    load.cache_clear()
+    return snapshot
+
+
+@functools.lru_cache(maxsize=None)
+def read_snapshot(path=SNAPSHOT):
+    """
+    Return the snapshot for the installed MDAnalysis and MDAnalysisTests,
+    only taking a new one if there is none yet or it is for another version.
+    """
+    try:
+        with open(path, "r") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        snapshot = None
+    if snapshot is None:
+        return write_snapshot(path)
+    versions = {
+        "version": get_version("MDAnalysis"),
+        "tests_version": get_version("MDAnalysisTests"),
+    }
+    for key, version in versions.items():
+        if version is not None and snapshot.get(key) != version:
+            return write_snapshot(path)
+    return snapshot
+
+
+@functools.lru_cache(maxsize=None)
+def load(path=SNAPSHOT):
+    """
+    Load the registries as dicts of :class:`Record` objects. Each class
+    is a single Record, shared between all registries it is in.
+    """
+    snapshot = read_snapshot(path)
+    classes = {}
+    for label, record in snapshot["classes"].items():
+        record = dict(record)
+        if "transplants" in record:
+            record["transplants"] = [
+                (name, Record(**method)) for name, method in record["transplants"]
+            ]
+        classes[label] = Record(**record)
+
+    loaded = {
+        name: {key: classes[label] for key, label in registry.items()}
+        for name, registry in snapshot["registries"].items()
+    }
+    loaded["conversion_factor"] = snapshot["conversion_factor"]
+    loaded["selections"] = Record(
+        "MDAnalysis.core",
+        "selection",
+        **{k: Record(**v) for k, v in snapshot["selections"].items()},
+    )
+
+    modules = {}
+    for name, tests in snapshot["topology_tests"].items():
+        tests = dict(tests)
+        for klass, test in tests.items():
+            if isinstance(test, dict):
+                tests[klass] = Record(**dict(test, parser=classes[test["parser"]]))
+        modules[name] = Record("MDAnalysisTests.topology", name, **tests)
+    loaded["topology_tests"] = Record("MDAnalysisTests", "topology", **modules)
+    return loaded
+
+
+def fingerprint(name, path=SNAPSHOT):
+    """
+    Hash of the snapshot of one registry, including the classes in it.
+    """
+    snapshot = read_snapshot(path)
+    classes = snapshot["classes"]
+    if name in snapshot["registries"]:
+        registry = snapshot["registries"][name]
+        data = {k: classes[label] for k, label in registry.items()}
+    elif name == "topology_tests":
+        tests = snapshot[name]
+        parsers = {
+            test["parser"]
+            for module in tests.values()
+            for test in module.values()
+            if isinstance(test, dict)
+        }
+        data = [tests, {label: classes[label] for label in sorted(parsers)}]
+    else:
+        data = snapshot[name]
+    data = json.dumps([snapshot["version"], data])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def __getattr__(name):
+    # only load the snapshot for the names it contains, not for any
+    # attribute the import system looks up on the module
+    if name not in REGISTRIES + NAMESPACES:
+        raise AttributeError(name)
+    return load()[name]
+
+
+if __name__ == "__main__":
+    write_snapshot()
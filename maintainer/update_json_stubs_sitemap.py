@@ -8,22 +8,43 @@
 #  2. Write some redirect stubs
 #  3. Write a sitemap.xml file for the root directory
 #
+# The published versions.json is fetched with a timeout of $TIMEOUT
+# seconds (default 10) and cached in $CACHE_DIR (default
+# ~/.cache/mdanalysis_userguide). A cached copy is revalidated with
+# If-None-Match / If-Modified-Since, and used as is if the request fails.
+# With $OFFLINE=1, only the cached copy or a local versions.json is used.
+#
 
-import errno
+import concurrent.futures
 import glob
+import hashlib
 import json
 import os
+import re
 import shutil
 import textwrap
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from packaging.version import InvalidVersion, Version
 
 try:
+    from urllib.error import HTTPError
     from urllib.request import Request, urlopen
 except ImportError:
-    from urllib2 import Request, urlopen
+    from urllib2 import HTTPError, Request, urlopen
 
 URL = os.environ["URL"]
 VERSION = os.environ["VERSION"]
+TIMEOUT = float(os.environ.get("TIMEOUT", 10))
+OFFLINE = os.environ.get("OFFLINE", "") not in ("", "0")
+CACHE_DIR = os.environ.get(
+    "CACHE_DIR",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+        "mdanalysis_userguide",
+    ),
+)
 
 if "http" not in URL:
     raise ValueError(
@@ -38,83 +59,197 @@ except ValueError:
     ) from None
 
 
-def get_web_file(filename, callback, default):
+def fetch_web_file(filename):
+    """Fetch a file from $URL, through the cache in $CACHE_DIR
+
+    Returns the contents, or None if the file could not be fetched and
+    has not been cached before.
+    """
     url = os.path.join(URL, filename)
+    path = os.path.join(CACHE_DIR, hashlib.sha256(url.encode()).hexdigest())
+    try:
+        with open(path + ".json", "r") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = None
+    if OFFLINE:
+        return None if cached is None else cached["data"]
+
+    headers = {"User-Agent": "Mozilla/5.0"}
+    if cached is not None:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
     try:
-        page = Request(url, headers={"User-Agent": "Mozilla/5.0"})
-        data = urlopen(page).read().decode()
+        with urlopen(Request(url, headers=headers), timeout=TIMEOUT) as response:
+            data = response.read().decode()
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    except HTTPError as e:
+        if e.code == 304:
+            print(f"Using cached {url}: not modified")
+        else:
+            print(e)
+        return None if cached is None else cached["data"]
     except Exception as e:
         print(e)
+        return None if cached is None else cached["data"]
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"etag": etag, "last_modified": last_modified, "data": data}, f)
+    os.replace(path + ".tmp", path + ".json")
+    return data
+
+
+def get_web_file(filename, callback, default):
+    data = fetch_web_file(filename)
+    if data is None:
         try:
             with open(filename, "r") as f:
-                return callback(f)
+                data = f.read()
         except IOError as e:
             print(e)
             return default
-    else:
-        return callback(data)
+    return callback(data)
 
 
-def write_redirect(file, version="", outfile=None):
-    if outfile is None:
-        outfile = file
-    url = os.path.join(URL, version, file)
-    REDIRECT = textwrap.dedent(
-        f"""
+REDIRECT = textwrap.dedent(
+    """
     <!DOCTYPE html>
     <meta charset="utf-8">
     <title>Redirecting to {url}</title>
     <meta http-equiv="refresh" content="0; URL={url}">
     <link rel="canonical" href="{url}">
     """
-    )
+)
+
+
+def write_redirect(file, version="", outfile=None):
+    if outfile is None:
+        outfile = file
+    url = os.path.join(URL, version, file)
     with open(outfile, "w") as f:
-        f.write(REDIRECT)
+        f.write(REDIRECT.format(url=url))
     print(f"Wrote redirect from {url} to {outfile}")
 
 
-# ========= WRITE JSON =========
-# Update $root/versions.json with links to the right version
-versions = get_web_file("versions.json", json.loads, [])
-existing = [item["version"] for item in versions]
-already_exists = VERSION in existing
-latest = "dev" not in VERSION
+def write_redirects(redirects):
+    """Write redirect stubs in bulk
 
-if not already_exists:
-    if latest:
+    ``redirects`` maps each stub to the file it redirects to. Stubs
+    that already exist with the same contents are left alone.
+    """
+
+    def write(item):
+        outfile, file = item
+        contents = REDIRECT.format(url=os.path.join(URL, file))
+        try:
+            with open(outfile, "r") as f:
+                if f.read() == contents:
+                    return False
+        except OSError:
+            pass
+        with open(outfile, "w") as f:
+            f.write(contents)
+        return True
+
+    for dirname in {os.path.dirname(outfile) for outfile in redirects} - {""}:
+        os.makedirs(dirname, exist_ok=True)
+
+    with concurrent.futures.ThreadPoolExecutor() as pool:
+        n_written = sum(pool.map(write, redirects.items()))
+    print(
+        f"Wrote {n_written} redirects, "
+        f"{len(redirects) - n_written} already up to date"
+    )
+
+
+class VersionRegistry:
+    """The versions listed in versions.json, indexed by version
+
+    The latest and dev pointers follow the same rules as when versions
+    were kept in a list: latest is the version last flagged as latest,
+    dev the last "-dev" version added, and either falls back to the
+    last version added. Versions are serialised in version order, with
+    names that are not versions, e.g. stable and dev, last.
+    """
+
+    def __init__(self, versions=()):
+        self._versions = {}
+        self._latest = None
+        self._dev = None
         for ver in versions:
-            ver["latest"] = False
+            self._versions[ver["version"]] = ver
+            if ver["latest"]:
+                self._latest = ver["version"]
+            if "-dev" in ver["version"]:
+                self._dev = ver["version"]
+
+    def __contains__(self, version):
+        return version in self._versions
+
+    def __iter__(self):
+        return iter(self.to_list())
 
-    versions.append(
-        {
-            "version": VERSION,
-            "display": VERSION,
-            "url": os.path.join(URL, VERSION),
+    def __getitem__(self, version):
+        return self._versions[version]
+
+    @staticmethod
+    def sort_key(version):
+        try:
+            return (0, Version(version), "")
+        except InvalidVersion:
+            return (1, Version("0"), version)
+
+    def add(self, version, latest=False):
+        """Add a version, or update the URL of an existing one"""
+        url = os.path.join(URL, version)
+        if version in self._versions:
+            self._versions[version]["url"] = url
+            return
+        if latest:
+            for ver in self._versions.values():
+                ver["latest"] = False
+            self._latest = version
+        if "-dev" in version:
+            self._dev = version
+        self._versions[version] = {
+            "version": version,
+            "display": version,
+            "url": url,
             "latest": latest,
         }
-    )
 
-for ver in versions[::-1]:
-    if ver["latest"]:
-        latest_version = ver["version"]
-        break
-else:
-    try:
-        latest_version = versions[-1]["version"]
-    except IndexError:
-        latest_version = None
-
-for ver in versions[::-1]:
-    if "-dev" in ver["version"]:
-        dev_version = ver["version"]
-        break
-else:
-    try:
-        dev_version = versions[-1]["version"]
-    except IndexError:
-        dev_version = None
+    def _last(self):
+        return next(reversed(self._versions), None)
+
+    @property
+    def latest_version(self):
+        return self._latest if self._latest is not None else self._last()
+
+    @property
+    def dev_version(self):
+        return self._dev if self._dev is not None else self._last()
+
+    def to_list(self):
+        return sorted(
+            self._versions.values(), key=lambda x: self.sort_key(x["version"])
+        )
 
-versions.sort(key=lambda x: x["version"])
+
+# ========= WRITE JSON =========
+# Update $root/versions.json with links to the right version
+versions = VersionRegistry(get_web_file("versions.json", json.loads, []))
+already_exists = VERSION in versions
+latest = "dev" not in VERSION
+
+if not already_exists:
+    versions.add(VERSION, latest=latest)
+
+latest_version = versions.latest_version
+dev_version = versions.dev_version
 
 # ========= WRITE HTML STUBS AND COPY DOCS =========
 # Add HTML files to redirect:
@@ -122,7 +257,105 @@ versions.sort(key=lambda x: x["version"])
 # latest/index.html -> latest release (not dev docs)
 # stable/ : a copy of the release docs with the highest number (2.0.0 instead of 1.0.0)
 # dev/ : a copy of the develop docs with the highest number (2.0.0-dev instead of 1.0.1-dev)
-# sitemap.xml files are updated by replacing URL strings
+# sitemap.xml files are updated by replacing URL strings, and split into
+# sitemap.xml, sitemap-2.xml, ... if they exceed the limits of the protocol
+#
+# stable/ and dev/ are synced rather than copied: only files whose
+# contents changed are replaced, by hardlinks where possible, so an
+# existing stable/ is barely touched by a deploy. Redirect stubs are only
+# written if missing or different on disk, and removed for pages removed
+# from stable/.
+
+
+# https://www.sitemaps.org/protocol.html#index
+SITEMAP_MAX_URLS = 50000
+SITEMAP_MAX_BYTES = 50 * 1024 * 1024
+
+
+def serialize_element(element, prefixes):
+    """Write an element the way ElementTree does, using the namespace
+    prefixes of the document rather than declaring them again"""
+
+    def name(tag):
+        if tag[0] == "{":
+            uri, tag = tag[1:].split("}")
+            if prefixes.get(uri):
+                return f"{prefixes[uri]}:{tag}"
+        return tag
+
+    tag = name(element.tag)
+    parts = [f"<{tag}"]
+    for key, value in element.attrib.items():
+        value = escape(value, {'"': "&quot;", "\n": "&#10;"})
+        parts.append(f' {name(key)}="{value}"')
+    if element.text is None and not len(element):
+        parts.append(" />")
+    else:
+        parts.append(">")
+        parts.append(escape(element.text or ""))
+        for child in element:
+            parts.append(serialize_element(child, prefixes))
+        parts.append(f"</{tag}>")
+    parts.append(escape(element.tail or ""))
+    return "".join(parts)
+
+
+class SitemapWriter:
+    """Write <url> elements to sitemap.xml, sitemap-2.xml, ... in a
+    directory, starting a new file whenever one would exceed the
+    sitemap limits"""
+
+    header = "<?xml version='1.0' encoding='utf-8'?>\n"
+
+    def __init__(self, directory, root, prefixes, header=None):
+        if header is not None:
+            self.header = header
+        self.directory = directory
+        self.prefixes = prefixes
+        namespaces = "".join(
+            f' xmlns:{prefix}="{uri}"' if prefix else f' xmlns="{uri}"'
+            for uri, prefix in prefixes.items()
+        )
+        tag = root.tag.split("}")[-1]
+        self.start = f"{self.header}<{tag}{namespaces}>".encode()
+        self.end = f"</{tag}>".encode()
+        self.files = []
+        self.f = None
+
+    def _open(self):
+        n = len(self.files) + 1
+        filename = "sitemap.xml" if n == 1 else f"sitemap-{n}.xml"
+        self.files.append(filename)
+        # the sitemap may be hardlinked to the original, so replace
+        # the file instead of writing to it
+        self.f = open(os.path.join(self.directory, filename + ".tmp"), "wb")
+        self.f.write(self.start)
+        self.n_urls = 0
+        self.n_bytes = len(self.start) + len(self.end)
+
+    def _close(self):
+        self.f.write(self.end)
+        self.f.close()
+        os.replace(self.f.name, self.f.name[:-4])
+
+    def write(self, element):
+        data = serialize_element(element, self.prefixes).encode()
+        if self.f is None or (
+            self.n_urls + 1 > SITEMAP_MAX_URLS
+            or self.n_bytes + len(data) > SITEMAP_MAX_BYTES
+        ):
+            if self.f is not None:
+                self._close()
+            self._open()
+        self.f.write(data)
+        self.n_urls += 1
+        self.n_bytes += len(data)
+
+    def close(self):
+        if self.f is None:
+            self._open()
+        self._close()
+        return self.files
 
 
 def redirect_sitemap(old_version, new_version):
@@ -130,63 +363,159 @@ def redirect_sitemap(old_version, new_version):
 
     Sitemaps can only contain URLs 'within' that directory structure.
     For more, see https://www.sitemaps.org/faq.html#faq_sitemap_location
+
+    The sitemap is read and rewritten one <url> at a time, and split
+    into several files if it is too large. Returns the names of the
+    sitemap files written.
     """
     file = f"{new_version}/sitemap.xml"
     old = f"{URL}/{old_version}/"
     new = f"{URL}/{new_version}/"
     try:
         with open(file, "r") as f:
-            contents = f.read()
+            start = f.read(256)
     except OSError:
         raise ValueError(f"{file} not found")
-    redirected = contents.replace(old, new)
-    with open(file, "w") as f:
-        f.write(redirected)
+    # keep the XML declaration of the original
+    header = None
+    if start.startswith("<?xml") and "?>" in start:
+        header = start[: start.index("?>") + 2]
+        if start[len(header) : len(header) + 1] == "\n":
+            header += "\n"
+
+    prefixes = {}
+    writer = None
+    depth = 0
+    for event, item in ET.iterparse(file, events=("start-ns", "start", "end")):
+        if event == "start-ns":
+            prefix, uri = item
+            prefixes[uri] = prefix
+        elif event == "start":
+            if depth == 0:
+                root = item
+                writer = SitemapWriter(new_version, root, prefixes, header)
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1:
+                for element in item.iter():
+                    if element.text:
+                        element.text = element.text.replace(old, new)
+                    for key, value in element.attrib.items():
+                        element.set(key, value.replace(old, new))
+                writer.write(item)
+                root.clear()
+    files = writer.close()
+    # remove parts left over from a larger sitemap
+    for part in list_sitemaps(new_version)[1:]:
+        if part not in files:
+            os.remove(os.path.join(new_version, part))
     print(f"Redirected URLs in {file} from {old} to {new}")
-
-
-def add_or_update_version(version):
-    """Add or update the version path to versions.json"""
-    for ver in versions:
-        if ver["version"] == version:
-            ver["url"] = os.path.join(URL, version)
-            break
-    else:
-        versions.append(
-            {
-                "version": version,
-                "display": version,
-                "url": os.path.join(URL, version),
-                "latest": False,
-            }
-        )
+    if len(files) > 1:
+        print(f"Split {file} into {len(files)} sitemaps")
+    return files
+
+
+def list_sitemaps(version):
+    """Return the sitemap files of a version, assuming only sitemap.xml
+    for versions that are not present locally"""
+    parts = []
+    for part in glob.glob(f"{version}/sitemap-*.xml"):
+        match = re.fullmatch(r"sitemap-(\d+)\.xml", os.path.basename(part))
+        if match:
+            parts.append((int(match.group(1)), match.group(0)))
+    return ["sitemap.xml"] + [part for _, part in sorted(parts)]
+
+
+def list_files(directory):
+    """Return the paths of all files in a directory, relative to it"""
+    files = set()
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            files.add(os.path.relpath(path, directory))
+    return files
+
+
+def hash_file(file):
+    sha = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def same_contents(file1, file2):
+    if os.path.samefile(file1, file2):
+        return True
+    if os.path.getsize(file1) != os.path.getsize(file2):
+        return False
+    return hash_file(file1) == hash_file(file2)
+
+
+def sync_version(old_version, new_version):
+    """Make one directory a copy of another, only replacing files whose
+    contents differ. Files are hardlinked if possible, else copied.
+
+    Returns the files added to and removed from the copy, as paths
+    relative to it.
+    """
+    old_files = list_files(old_version)
+    new_files = list_files(new_version) if os.path.isdir(new_version) else set()
+    n_changed = 0
+    for file in sorted(old_files):
+        src = os.path.join(old_version, file)
+        dst = os.path.join(new_version, file)
+        if file in new_files:
+            if same_contents(src, dst):
+                continue
+            os.remove(dst)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+        n_changed += 1
+    for file in new_files - old_files:
+        os.remove(os.path.join(new_version, file))
+    # remove directories left empty, deepest first
+    for dirpath, _, _ in sorted(os.walk(new_version), reverse=True):
+        if dirpath != new_version and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    added = old_files - new_files
+    removed = new_files - old_files
+    print(
+        f"Synced {old_version} to {new_version}: {len(added)} added, "
+        f"{n_changed - len(added)} changed, {len(removed)} removed"
+    )
+    return added, removed
 
 
 def copy_version(old_version, new_version):
-    """Copy docs from one directory to another with all bells and whistles"""
-    shutil.copytree(old_version, new_version)
-    print(f"Copied {old_version} to {new_version}")
+    """Copy docs from one directory to another with all bells and whistles
+
+    Returns the files added to and removed from the copy.
+    """
+    added, removed = sync_version(old_version, new_version)
     redirect_sitemap(old_version, new_version)
-    add_or_update_version(new_version)
+    versions.add(new_version)
+    return added, removed
 
 
 # Copy stable/ docs and write redirects from root level docs
 if latest:
-    copy_version(VERSION, "stable")
+    _, removed = copy_version(VERSION, "stable")
+    for outfile in removed:
+        if outfile.endswith(".html") and os.path.isfile(outfile):
+            os.remove(outfile)
+            print(f"Removed redirect {outfile}")
     html_files = glob.glob(f"stable/**/*.html", recursive=True)
+    redirects = {}
     for file in html_files:
         # below should be true because we only globbed stable/* paths
         assert file.startswith("stable/")
-        outfile = file[7:]  # strip "stable/"
-        dirname = os.path.dirname(outfile)
-        if dirname and not os.path.exists(dirname):
-            try:
-                os.makedirs(dirname)
-            except OSError as exc:
-                if exc.errno != errno.EEXIST:
-                    raise
-
-        write_redirect(file, "", outfile)
+        redirects[file[7:]] = file  # strip "stable/"
+    write_redirects(redirects)
 
 # Separate just in case we update versions.json or muck around manually
 # with docs
@@ -200,7 +529,7 @@ if dev_version and dev_version == VERSION:
 
 # update versions.json online
 with open("versions.json", "w") as f:
-    json.dump(versions, f, indent=2)
+    json.dump(versions.to_list(), f, indent=2)
 
 
 # ========= WRITE SUPER SITEMAP.XML =========
@@ -227,9 +556,10 @@ ET.register_namespace("xhtml", "http://www.w3.org/1999/xhtml")
 bigroot = ET.Element("sitemapindex")
 bigroot.set("xmlns", "http://www.sitemaps.org/schemas/sitemap/0.9")
 for ver in versions:
-    path = os.path.join(URL, "{}/sitemap.xml".format(ver["version"]))
-    sitemap = ET.SubElement(bigroot, "sitemap")
-    ET.SubElement(sitemap, "loc").text = path
+    for filename in list_sitemaps(ver["version"]):
+        path = os.path.join(URL, "{}/{}".format(ver["version"], filename))
+        sitemap = ET.SubElement(bigroot, "sitemap")
+        ET.SubElement(sitemap, "loc").text = path
 
 ET.ElementTree(bigroot).write(
     "sitemap_index.xml", xml_declaration=True, encoding="utf-8", method="xml"